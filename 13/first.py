@@ -2,7 +2,7 @@
 
 import sys
 sys.path.insert(0, "..")
-from intcode import IntcodeComputer
+from intcode import IntcodeComputer, run_cached
 
 from itertools import groupby
 
@@ -12,10 +12,7 @@ if __name__ == "__main__":
 
     lines = sys.stdin.readlines()
     program = IntcodeComputer.read_input(lines[0])
-    computer = IntcodeComputer(program)
-    computer.run()
-
-    out = computer.flush_output()
+    out = run_cached(program)
     gb = groupby(enumerate(out), lambda x: x[0] // 3)
     ys = [y for y in (list(x[1]) for x in gb)]
     insts = [(y[0][1], y[1][1], y[2][1]) for y in ys]
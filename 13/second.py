@@ -3,11 +3,9 @@
 import sys  # isort:skip
 
 sys.path.insert(0, "..")  # isort:skip
-from intcode import IntcodeComputer  # isort:skip
+from intcode import IntcodeComputer, load_image  # isort:skip
 
 import os
-import queue
-import threading
 from collections import defaultdict
 from enum import IntEnum
 from itertools import groupby
@@ -15,8 +13,18 @@ from operator import itemgetter
 from time import sleep
 
 
-def iterable_queue(q):
-    return iter(lambda: q.get(), None)
+def joystick(machine, arcade):
+    """
+    Pass the game's output through, answering every request for input with
+    the arcade's current paddle tilt.
+    """
+    for val in machine:
+        while val is None:
+            try:
+                val = machine.send(arcade.paddle_tilt)
+            except StopIteration:
+                return
+        yield val
 
 
 class Tile(IntEnum):
@@ -30,29 +38,8 @@ class Tile(IntEnum):
 OBSTACLES = (Tile.WALL, Tile.BLOCK, Tile.PADDLE)
 
 
-class Blah:
-    def __init__(self, arcade, output_ready, output_queue):
-        self.arcade = arcade
-        self.output_ready = output_ready
-        self.output_queue = output_queue
-
-    def run(self):
-        while True:
-            # print('zxcv'*100)
-            with self.output_ready:
-                # print('qwer'*100)
-                if self.output_ready.wait():
-                    # print('asdf'*2)
-                    tilt = self.arcade.paddle_tilt
-                    self.output_queue.put(tilt)
-
-
 class Arcade:
-    def __init__(self, input_queue, output_queue, output_ready):
-        self.input_queue = input_queue
-        self.output_queue = output_queue
-        self.output_ready = output_ready
-
+    def __init__(self):
         self.direction = 0
         self.score = 0
         self.paddle = None
@@ -137,9 +124,8 @@ class Arcade:
 
         return out
 
-    def run(self):
-        iq = iterable_queue(self.input_queue)
-        gb = groupby(enumerate(iq), lambda x: x[0] // 3)
+    def run(self, outputs):
+        gb = groupby(enumerate(outputs), lambda x: x[0] // 3)
         ys = (y for y in (list(x[1]) for x in gb))
         insts = ((y[0][1], y[1][1], y[2][1]) for y in ys)
 
@@ -276,25 +262,14 @@ if __name__ == "__main__":
     lines = sys.stdin.readlines()
     program = IntcodeComputer.read_input(lines[0])
     program[0] = 2
-
-    oq = queue.Queue(1)
-    iq = queue.Queue(1)
-    ready = threading.Condition()
-
-    arcade = Arcade(oq, iq, ready)
-    blah = Blah(arcade, ready, iq)
-    computer = IntcodeComputer(program, iq, oq, ready)
-
-    arcade_thread = threading.Thread(target=arcade.run, name="Arcade")
-    computer_thread = threading.Thread(target=computer.run, name="Computer")
-    blah_thread = threading.Thread(target=blah.run, name="Blah", daemon=True)
-
-    blah_thread.start()
-    computer_thread.start()
-    arcade_thread.start()
-
-    computer_thread.join()
-    oq.put(None)
-    arcade_thread.join()
+    image = load_image(program)
+
+    arcade = Arcade()
+    computer = IntcodeComputer(image, compiled=True)
+    # python second.py 13.trace < input records the game for benchmark.py.
+    trace = computer.record() if len(sys.argv) > 1 else None
+    arcade.run(joystick(computer.execute(), arcade))
+    if trace:
+        trace.save(sys.argv[1])
 
     # print(arcade)
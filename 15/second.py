@@ -3,10 +3,8 @@
 import sys  # isort:skip
 
 sys.path.insert(0, "..")  # isort:skip
-from intcode import IntcodeComputer  # isort:skip
+from intcode import IntcodeComputer, load_image  # isort:skip
 
-import queue
-import threading
 from collections import defaultdict
 from enum import IntEnum
 from functools import partial
@@ -36,46 +34,29 @@ def neighbors(loc):
 
 
 class Droid:
-    def __init__(self, input_queue, output_queue, output_ready, path, area):
-        self.area = defaultdict(lambda: Tile.UNKNOWN)
-        self.input_queue = input_queue
-        self.output_queue = output_queue
-        self.output_ready = output_ready
+    def __init__(self, computer, path, area):
+        self.computer = computer.fork()
         self.path = path
         self.area = area
         self.last_tile = Tile.OPEN
 
-    def output(self, val):
-        self.output_queue.put(val)
-        with self.output_ready:
-            self.output_ready.notify_all()
-
     def run(self):
-        for movement, location in self.path[1:]:
-            self.output(movement)
-            self.last_tile = Tile(self.input_queue.get())
-            self.area[location] = self.last_tile
-        self.output(99)
-
-
-def run_it(program, path, area):
-    oq = queue.Queue(1)
-    iq = queue.Queue(1)
-    ready = threading.Condition()
-
-    droid = Droid(oq, iq, ready, path, area)
-    computer = IntcodeComputer(program[:], iq, oq, ready)
+        # The computer has already walked the droid along the rest of the path.
+        if len(self.path) < 2:
+            return
 
-    droid_thread = threading.Thread(target=droid.run, name="Droid")
-    computer_thread = threading.Thread(target=computer.run, name="Computer")
+        machine = self.computer.execute()
+        next(machine)
+        movement, location = self.path[-1]
+        self.last_tile = Tile(machine.send(movement))
+        self.area[location] = self.last_tile
 
-    droid_thread.start()
-    computer_thread.start()
 
-    droid_thread.join()
-    computer_thread.join()
+def run_it(computer, path, area):
+    droid = Droid(computer, path, area)
+    droid.run()
 
-    return droid.last_tile
+    return droid.last_tile, droid.computer
 
 
 def show_area(area, droid_loc=None):
@@ -113,7 +94,7 @@ def max_distance(edges, start, area):
             complete[v].append(k)
             complete[k].append(v)
 
-    distances = defaultdict(lambda: 10 ** 5)
+    distances = defaultdict(lambda: 10**5)
     S = [start]
     distances[start] = 0
 
@@ -134,14 +115,14 @@ def discover_area(program):
     area[(0, 0)] = Tile.OPEN
     edges = defaultdict(lambda: [])
     paths = []
-    Q = [[(0, (0, 0))]]
+    Q = [([(0, (0, 0))], IntcodeComputer(program, compiled=True))]
     oxygen_loc = None
 
     while len(Q) > 0:
-        path = Q.pop(0)
+        path, computer = Q.pop(0)
         show_area(area, path[-1][1])
 
-        last_tile = run_it(program, path, area)
+        last_tile, computer = run_it(computer, path, area)
 
         if last_tile is Tile.OXYGEN:
             oxygen_loc = path[-1][1]
@@ -159,7 +140,7 @@ def discover_area(program):
             if area[neighbor[1]] is not Tile.UNKNOWN:
                 continue
             newpath = path[:] + [neighbor]
-            Q.append(newpath)
+            Q.append((newpath, computer))
 
     return edges, oxygen_loc, area
 
@@ -168,6 +149,6 @@ if __name__ == "__main__":
     import sys
 
     lines = sys.stdin.readlines()
-    program = IntcodeComputer.read_input(lines[0])
+    program = load_image(lines[0])
     edges, oxygen_loc, area = discover_area(program)
     print(max_distance(edges, oxygen_loc, area))
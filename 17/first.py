@@ -3,10 +3,8 @@
 import sys  # isort:skip
 
 sys.path.insert(0, "..")  # isort:skip
-from intcode import IntcodeComputer  # isort:skip
+from intcode import IntcodeComputer, load_image  # isort:skip
 
-import queue
-import threading
 from textwrap import dedent
 
 
@@ -62,14 +60,14 @@ def find_intersections(camera):
 
 
 class ASCII:
-    def __init__(self, input_queue):
-        self.input_queue = input_queue
+    def __init__(self, machine):
+        self.machine = machine
         self.camera = ""
 
     def run(self):
         self.camera = ""
         while True:
-            self.camera += chr(self.input_queue.get())
+            self.camera += chr(next(self.machine))
             if self.camera[-2:] == "\n\n":
                 break
 
@@ -78,21 +76,10 @@ if __name__ == "__main__":
     lines = sys.stdin.readlines()
     program = IntcodeComputer.read_input(lines[0])
     program[0] = 2
+    image = load_image(program)
 
-    oq = queue.Queue(1)
-    iq = queue.Queue(1)
-    ready = threading.Condition()
-
-    ascii = ASCII(oq)
-    computer = IntcodeComputer(program[:], iq, oq, ready)
-
-    ascii_thread = threading.Thread(target=ascii.run, name="ASCII")
-    computer_thread = threading.Thread(target=computer.run, name="Computer")
-
-    ascii_thread.start()
-    computer_thread.start()
-
-    ascii_thread.join()
-    computer_thread.join()
+    computer = IntcodeComputer(image, compiled=True)
+    ascii = ASCII(computer.execute())
+    ascii.run()
 
     print(alignment_parameter_sum(ascii.camera[:-2].split("\n")))
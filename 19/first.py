@@ -3,36 +3,18 @@
 import sys  # isort:skip
 
 sys.path.insert(0, "..")  # isort:skip
-from intcode import IntcodeComputer  # isort:skip
-
-import queue
-import threading
-
-
-def computer_generator(program):
-    while True:
-        oq = queue.Queue(1)
-        iq = queue.Queue(2)
-        computer = IntcodeComputer(program[:], iq, oq, threading.Condition())
-
-        def process(x, y):
-            iq.put(x)
-            iq.put(y)
-            computer.run()
-            return oq.get()
-
-        yield process
-
+from intcode import RESULTS, IntcodeComputer, load_image  # isort:skip
+from lockstep import LockstepComputer  # isort:skip
 
 if __name__ == "__main__":
     lines = sys.stdin.readlines()
     program = IntcodeComputer.read_input(lines[0])
-    computers = computer_generator(program)
 
-    points = 0
-    for y in range(50):
-        for x in range(50):
-            computer = next(computers)
-            points += computer(x, y)
+    probes = [(x, y) for y in range(50) for x in range(50)]
+    outputs = RESULTS.run_many(
+        load_image(program),
+        probes,
+        lambda image, jobs: LockstepComputer(image, jobs).run(),
+    )
 
-    print(points)
+    print(sum(detected for detected, in outputs))
@@ -3,29 +3,13 @@
 import sys  # isort:skip
 
 sys.path.insert(0, "..")  # isort:skip
-from intcode import IntcodeComputer  # isort:skip
+from intcode import RESULTS, IntcodeComputer, load_image  # isort:skip
+from lockstep import LockstepComputer  # isort:skip
 
-import queue
-import threading
 from functools import lru_cache
 from itertools import count
 
 
-def computer_generator(program):
-    while True:
-        oq = queue.Queue(1)
-        iq = queue.Queue(2)
-        computer = IntcodeComputer(program[:], iq, oq, threading.Condition())
-
-        def process(x, y):
-            iq.put(x)
-            iq.put(y)
-            computer.run()
-            return oq.get()
-
-        yield process
-
-
 def range_overlap(range1, range2):
     """
     >>> len(range_overlap((1,5), (3,7)))
@@ -36,22 +20,25 @@ def range_overlap(range1, range2):
     return range(max(range1[0], range2[0]), min(range1[1], range2[1]))
 
 
+def run_lanes(image, probes):
+    return LockstepComputer(image, probes).run()
+
+
 @lru_cache(maxsize=1024)
 def beam(y):
     if y < 3:
         return (0, 0)
 
-    started = 0
-    for x in count(beam(y - 1)[0]):
-        seen = False
-        computer = next(computers)
-        detected = computer(x, y)
-
-        if not started and detected:
-            started = x
-
-        if started and not detected:
-            return (started, x)
+    # Probe a little past where the previous row ends, all in one batch.
+    start, end = beam(y - 1)
+    width = end - start + 8
+    while True:
+        xs = range(start, start + width)
+        outputs = RESULTS.run_many(image, [(x, y) for x in xs], run_lanes)
+        detected = [x for x, (output,) in zip(xs, outputs) if output]
+        if detected and detected[-1] < xs[-1]:
+            return (detected[0], detected[-1] + 1)
+        width *= 2
 
 
 def seek_in_beam(size):
@@ -67,8 +54,7 @@ def seek_in_beam(size):
 
 if __name__ == "__main__":
     lines = sys.stdin.readlines()
-    program = IntcodeComputer.read_input(lines[0])
-    computers = computer_generator(program)
+    image = load_image(IntcodeComputer.read_input(lines[0]))
 
     for i in range(3, 101):
         x, y = seek_in_beam(i)
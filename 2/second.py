@@ -1,5 +1,11 @@
 #!/usr/bin/env python
 
+import sys  # isort:skip
+
+sys.path.insert(0, "..")  # isort:skip
+from farm import Farm  # isort:skip
+
+from itertools import product
 from textwrap import dedent
 
 
@@ -60,18 +66,19 @@ def process(memory):
             raise Exception("Unexpected intcode: %s" % intcode)
 
 
-def search(memory, target):
-    orig = memory
+def attempt(memory, noun_verb):
+    memory = memory[:]
+    memory[1], memory[2] = noun_verb
+    return process(memory)[0]
 
-    for noun in range(0, 100):
-        for verb in range(0, 100):
-            memory = orig[:]
-            memory[1] = noun
-            memory[2] = verb
-            out = process(memory)
 
-            if out[0] == target:
-                return (noun, verb)
+def search(memory, target):
+    jobs = product(range(0, 100), range(0, 100))
+    with Farm(memory, attempt) as farm:
+        found = farm.find(jobs, lambda output: output == target)
+
+    if found:
+        return found[0]
 
 
 if __name__ == "__main__":
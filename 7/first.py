@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 
-import operator
-from itertools import permutations
+import sys  # isort:skip
+
+sys.path.insert(0, "..")  # isort:skip
+from farm import Farm  # isort:skip
+from intcode import load_image, run_cached  # isort:skip
+
 from textwrap import dedent
 
 
@@ -176,6 +180,64 @@ def calculate_thruster(program, phase_sequence):
     return input_signal
 
 
+class PhaseSearch(object):
+    """
+    Finds the best phase settings by walking the trie of phase prefixes
+    instead of trying every permutation on its own. An amplifier's output
+    only depends on its phase and input signal, so each pair is run once,
+    and the best thrust the remaining amplifiers can make only depends on
+    the phases left and the signal they get, so each of those is searched
+    once. `amplifiers` can be fewer than the phases to choose from.
+
+    >>> program = read_input('3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0')
+    >>> search = PhaseSearch(program)
+    >>> search.best(search.phases), len(search.outputs)
+    (43210, 261)
+    >>> PhaseSearch(program, range(7), amplifiers=3).best(frozenset(range(7)))
+    654
+    """
+
+    def __init__(self, program, phases=range(5), amplifiers=None):
+        self.image = load_image(program)
+        self.phases = frozenset(phases)
+        self.amplifiers = amplifiers or len(self.phases)
+        self.outputs = {}
+        self.thrusts = {}
+
+    def amplify(self, phase, signal):
+        try:
+            return self.outputs[phase, signal]
+        except KeyError:
+            outputs = run_cached(self.image, [phase, signal])
+            self.outputs[phase, signal] = outputs[0]
+            return outputs[0]
+
+    def best(self, remaining, signal=0):
+        """
+        The highest thrust the amplifiers still to be set up can make from
+        `signal`, using the phases in `remaining`.
+        """
+        if len(self.phases) - len(remaining) == self.amplifiers:
+            return signal
+
+        try:
+            return self.thrusts[remaining, signal]
+        except KeyError:
+            thrust = max(
+                self.best(remaining - {phase}, self.amplify(phase, signal))
+                for phase in remaining
+            )
+            self.thrusts[remaining, signal] = thrust
+            return thrust
+
+
+def search_phases(search, first):
+    """
+    The best thrust with `first` as the phase of the first amplifier.
+    """
+    return search.best(search.phases - {first}, search.amplify(first, 0))
+
+
 def optimize_thruster(program):
     """
     >>> program = read_input('3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0')
@@ -188,10 +250,8 @@ def optimize_thruster(program):
     >>> optimize_thruster(program)
     65210
     """
-    phases = list(permutations(range(5)))
-    thrusts = list(map(lambda p: calculate_thruster(program, p), phases))
-    max_index, max_thrust = max(enumerate(thrusts), key=operator.itemgetter(1))
-    return max_thrust
+    with Farm(program, search_phases, PhaseSearch) as farm:
+        return max(thrust for _, thrust in farm.map(range(5)))
 
 
 if __name__ == "__main__":
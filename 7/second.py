@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 
-import operator
-import queue
-import threading
-from itertools import permutations
+import sys  # isort:skip
+
+sys.path.insert(0, "..")  # isort:skip
+from farm import Farm  # isort:skip
+from intcode import Buffer, IntcodeComputer, Network, load_image  # isort:skip
+
+from functools import partial
 from textwrap import dedent
 
 
@@ -23,140 +26,6 @@ def read_input(inp):
     return [int(i.strip()) for i in inp.split(",")]
 
 
-def parse_modes(modes):
-    return [bool(int(i)) for i in f"{modes:04d}"[::-1]]
-
-
-class HaltException(Exception):
-    pass
-
-
-class IntcodeComputer(object):
-    def __init__(self, program, input_queue=queue.Queue(), output_queue=queue.Queue()):
-        self.memory = program[:]
-        self.pc = 0
-        self.input_queue = input_queue
-        self.output_queue = output_queue
-
-        self.operations = {
-            1: self.op_add,
-            2: self.op_mul,
-            3: self.op_load,
-            4: self.op_print,
-            5: self.op_jump_if_true,
-            6: self.op_jump_if_false,
-            7: self.op_less_than,
-            8: self.op_equals,
-            99: self.op_halt,
-        }
-
-    def read_memory(self, val, immediate_mode):
-        if immediate_mode:
-            return val
-        else:
-            return self.memory[val]
-
-    def op_add(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        result = operand1 + operand2
-        self.memory[self.memory[self.pc + 3]] = result
-        return self.pc + 4
-
-    def op_mul(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        result = operand1 * operand2
-        self.memory[self.memory[self.pc + 3]] = result
-        return self.pc + 4
-
-    def op_load(self, modes):
-        loc = self.memory[self.pc + 1]
-        val = int(self.input_queue.get())
-        self.memory[loc] = val
-        return self.pc + 2
-
-    def op_print(self, modes):
-        loc = self.memory[self.pc + 1]
-        self.output_queue.put(self.memory[loc])
-        return self.pc + 2
-
-    def op_jump_if_true(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        if operand1 > 0:
-            return operand2
-        else:
-            return self.pc + 3
-
-    def op_jump_if_false(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        if operand1 == 0:
-            return operand2
-        else:
-            return self.pc + 3
-
-    def op_less_than(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        loc = self.memory[self.pc + 3]
-        self.memory[loc] = 1 if operand1 < operand2 else 0
-        return self.pc + 4
-
-    def op_equals(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        loc = self.memory[self.pc + 3]
-        self.memory[loc] = 1 if operand1 == operand2 else 0
-        return self.pc + 4
-
-    def op_halt(self, modes):
-        raise HaltException()
-
-    def run(self):
-        """
-      >>> computer = IntcodeComputer([1, 0, 0, 2, 99])
-      >>> computer.run()
-      >>> computer.memory
-      [1, 0, 2, 2, 99]
-      >>> computer = IntcodeComputer([1,9,10,3,2,3,11,0,99,30,40,50])
-      >>> computer.run()
-      >>> computer.memory
-      [3500, 9, 10, 70, 2, 3, 11, 0, 99, 30, 40, 50]
-      >>> computer = IntcodeComputer([1,0,0,0,99])
-      >>> computer.run()
-      >>> computer.memory
-      [2, 0, 0, 0, 99]
-      >>> computer = IntcodeComputer([2,3,0,3,99])
-      >>> computer.run()
-      >>> computer.memory
-      [2, 3, 0, 6, 99]
-      >>> computer = IntcodeComputer([2,4,4,5,99,0])
-      >>> computer.run()
-      >>> computer.memory
-      [2, 4, 4, 5, 99, 9801]
-      >>> computer = IntcodeComputer([1,1,1,4,99,5,6,0,99])
-      >>> computer.run()
-      >>> computer.memory
-      [30, 1, 1, 4, 2, 5, 6, 0, 99]
-      """
-        while True:
-            intcode = self.memory[self.pc]
-
-            try:
-                opcode = intcode % 100
-                modes = parse_modes(intcode // 100)
-                op = self.operations[opcode]
-                self.pc = op(modes)
-
-            except HaltException:
-                return
-
-            except KeyError:
-                raise Exception("Unexpected intcode: %s" % intcode)
-
-
 def calculate_thruster(program, phase_sequence):
     """
     >>> program = program = read_input('3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0')
@@ -183,25 +52,112 @@ def calculate_thruster(program, phase_sequence):
     """
     amp_count = len(phase_sequence)
 
-    queues = [queue.Queue() for i in range(amp_count)]
-    computers = [
-        IntcodeComputer(program, queues[i], queues[(i + 1) % amp_count])
-        for i in range(amp_count)
-    ]
-    threads = [threading.Thread(target=computer.run) for computer in computers]
-
+    network = Network()
     for i in range(amp_count):
-        phase = int(phase_sequence[i])
-        queues[i].put(phase)
+        network.add(program)
+    for i in range(amp_count):
+        network.connect(i, (i + 1) % amp_count)
+        network.send(i, int(phase_sequence[i]))
+
+    network.send(0, 0)
+    network.run()
+
+    return network.machines[0].input_queue.get()
+
+
+class PhaseSearch(object):
+    """
+    Finds the best phase settings by walking the trie of phase prefixes
+    instead of trying every permutation on its own. Each amplifier is run
+    with its phase and input signal once, and then kept suspended where it
+    waits for its next signal; a longer prefix carries on from a fork of it.
+    Without feedback the best thrust of the remaining amplifiers only
+    depends on the phases left and the signal they get, so each of those is
+    searched once too. With feedback, every full ring is finished on a
+    Network of forks of its suspended amplifiers.
+
+    >>> program = read_input('3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,4,27,1001,28,-1,28,1005,28,6,99,0,0,5')
+    >>> search = PhaseSearch(program, range(5, 10), with_feedback=True)
+    >>> search.best(search.phases), len(search.amplified)
+    (139629729, 220)
+    >>> program = read_input('3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0')
+    >>> PhaseSearch(program, range(7), amplifiers=3).best(frozenset(range(7)))
+    654
+    """
+
+    def __init__(self, program, phases, amplifiers=None, with_feedback=False):
+        self.image = load_image(program)
+        self.phases = frozenset(phases)
+        self.amplifiers = amplifiers or len(self.phases)
+        self.with_feedback = with_feedback
+        self.started = {}
+        self.amplified = {}
+        self.thrusts = {}
 
-    queues[0].put(0)
+    def amplify(self, phase, signal):
+        """
+        The amplifier with `phase` once it has passed `signal` on, and what it
+        passed on.
+        """
+        try:
+            return self.amplified[phase, signal]
+        except KeyError:
+            pass
+
+        if phase not in self.started:
+            computer = IntcodeComputer(self.image, Buffer([phase]), Buffer())
+            computer.run()
+            self.started[phase] = computer
+
+        computer = self.started[phase].fork()
+        computer.input_queue, computer.output_queue = Buffer([signal]), Buffer()
+        computer.run()
+        self.amplified[phase, signal] = computer, computer.output_queue.get()
+        return self.amplified[phase, signal]
+
+    def finish(self, ring, signal):
+        """
+        Close the ring of suspended amplifiers, feed `signal` back into the
+        first one, and return the last signal once they have all halted.
+        """
+        network = Network()
+        for amplifier in ring:
+            network.add(amplifier.fork())
+        for i in range(len(ring)):
+            network.connect(i, (i + 1) % len(ring))
 
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
+        network.send(0, signal)
+        network.run()
+        return network.machines[0].input_queue.get()
 
-    return queues[0].get()
+    def best(self, remaining, signal=0, ring=()):
+        """
+        The highest thrust the amplifiers still to be set up can make from
+        `signal`, using the phases in `remaining`, after the amplifiers of
+        `ring`.
+        """
+        if len(ring) == self.amplifiers:
+            return self.finish(ring, signal) if self.with_feedback else signal
+
+        key = (remaining, signal)
+        if not self.with_feedback and key in self.thrusts:
+            return self.thrusts[key]
+
+        thrusts = []
+        for phase in remaining:
+            amplifier, output = self.amplify(phase, signal)
+            thrusts.append(self.best(remaining - {phase}, output, ring + (amplifier,)))
+
+        self.thrusts[key] = max(thrusts)
+        return self.thrusts[key]
+
+
+def search_phases(search, first):
+    """
+    The best thrust with `first` as the phase of the first amplifier.
+    """
+    amplifier, signal = search.amplify(first, 0)
+    return search.best(search.phases - {first}, signal, (amplifier,))
 
 
 def optimize_thruster(program, with_feedback):
@@ -223,14 +179,10 @@ def optimize_thruster(program, with_feedback):
     >>> optimize_thruster(program, True)
     18216
     """
-    if with_feedback:
-        phases = list(permutations([5, 6, 7, 8, 9]))
-    else:
-        phases = list(permutations([0, 1, 2, 3, 4]))
-
-    thrusts = list(map(lambda p: calculate_thruster(program, p), phases))
-    max_index, max_thrust = max(enumerate(thrusts), key=operator.itemgetter(1))
-    return max_thrust
+    phases = range(5, 10) if with_feedback else range(5)
+    setup = partial(PhaseSearch, phases=phases, with_feedback=with_feedback)
+    with Farm(program, search_phases, setup) as farm:
+        return max(thrust for _, thrust in farm.map(phases))
 
 
 if __name__ == "__main__":
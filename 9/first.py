@@ -1,5 +1,10 @@
 #!/usr/bin/env python
 
+import sys  # isort:skip
+
+sys.path.insert(0, "..")  # isort:skip
+from intcode import run_cached  # isort:skip
+
 import operator
 import queue
 import threading
@@ -307,9 +312,4 @@ if __name__ == "__main__":
     lines = sys.stdin.readlines()
     memory = read_input(lines[0])
 
-    input_queue = queue.Queue()
-    computer = IntcodeComputer(memory, input_queue, queue.Queue())
-
-    input_queue.put(2)
-    computer.run()
-    print(computer.flush_output()[0])
+    print(run_cached(memory, [2])[0])
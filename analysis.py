@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+"""
+What of an Intcode program is code and what is data: disassembles it from
+its entry point, splits the code into basic blocks joined by the jumps
+between them, and lists it with the writes that land in code flagged:
+
+    python analysis.py 19/input
+    python analysis.py 7/input --summary
+
+The block compiler and the decode cache in intcode.py don't use this. They
+work from whatever pc the program reaches, with memory as it is then, and
+drop what they cached when a watched cell is written; a graph built before
+the program runs can't see the jumps through return addresses or the code
+it patches in, which is most of what they have to handle.
+"""
+
+import argparse
+
+from intcode import INSTRUCTIONS, PARAMETER_COUNTS, IntcodeComputer, Mode, parse_modes
+
+
+def operand(param, mode):
+    """
+    >>> operand(5, Mode.ABSOLUTE), operand(5, Mode.IMMEDIATE), operand(-1, Mode.RELATIVE)
+    ('[5]', '5', '[rb-1]')
+    """
+    if mode is Mode.IMMEDIATE:
+        return str(param)
+    if mode is Mode.RELATIVE:
+        return f"[rb{param:+}]"
+    return f"[{param}]"
+
+
+class Instruction(object):
+    """
+    >>> instruction = Instruction(6, [105, 1, 0])
+    >>> str(instruction), instruction.size, instruction.target
+    ('jump_if_true 1, [0]', 3, None)
+    >>> Instruction(0, [21101, 11, 0, 0]).written
+    (0, <Mode.RELATIVE: 2>)
+    """
+
+    def __init__(self, address, cells):
+        self.address = address
+        self.intcode = cells[0]
+        self.opcode = self.intcode % 100
+        self.name = INSTRUCTIONS[self.opcode][0]
+        self.size = PARAMETER_COUNTS[self.opcode] + 1
+        modes = parse_modes(self.intcode // 100)
+        self.modes = tuple(modes[i] for i in range(self.size - 1))
+        self.params = tuple(cells[1 : self.size])
+
+    def __str__(self):
+        operands = [operand(p, m) for p, m in zip(self.params, self.modes)]
+        written = INSTRUCTIONS[self.opcode][2]
+        result = [] if written is None else ["->", operands.pop(written)]
+        return " ".join(filter(None, [self.name, ", ".join(operands)] + result))
+
+    @property
+    def following(self):
+        return self.address + self.size
+
+    @property
+    def jump(self):
+        return self.opcode == 5 or self.opcode == 6
+
+    @property
+    def condition(self):
+        """
+        Whether a jump is always (True) or never (False) taken, or None if
+        that depends on memory.
+        """
+        if not self.jump or self.modes[0] is not Mode.IMMEDIATE:
+            return None
+        return (self.params[0] > 0) == (self.opcode == 5)
+
+    @property
+    def target(self):
+        """
+        Where a jump goes if it's taken, when that's an immediate value.
+        """
+        if self.jump and self.modes[1] is Mode.IMMEDIATE:
+            return self.params[1]
+        return None
+
+    @property
+    def written(self):
+        """
+        The param and mode of the cell the instruction writes, or None.
+        """
+        index = INSTRUCTIONS[self.opcode][2]
+        if index is None:
+            return None
+        return self.params[index], self.modes[index]
+
+    @property
+    def constant(self):
+        """
+        The value the instruction writes if it can only be one value.
+        """
+        if self.opcode in (1, 2) and all(m is Mode.IMMEDIATE for m in self.modes[:2]):
+            a, b = self.params[:2]
+            return a + b if self.opcode == 1 else a * b
+        return None
+
+
+class Block(object):
+    def __init__(self, start):
+        self.start = start
+        self.instructions = []
+        self.successors = []
+        self.predecessors = []
+
+    @property
+    def end(self):
+        return self.instructions[-1].following
+
+    @property
+    def name(self):
+        return f"block_{self.start}"
+
+
+class ControlFlowGraph(object):
+    """
+    Follows every path from `entries` that it can without running the
+    program. A jump is followed where its target is immediate. A call, an
+    unconditional jump right after its return address was written as a
+    constant, is also followed to that return address, because compiled
+    Intcode returns through a jump it can't resolve. Every cell an
+    instruction starts at or has a parameter in is code, including cells
+    that are reached before they hold a valid instruction. Writes to
+    absolute addresses that hold code are self-modification, and relative
+    writes may be.
+
+    >>> program = [3,8,1001,8,10,8,105,1,0,0,10,4,9,99]
+    >>> graph = ControlFlowGraph(program)
+    >>> sorted(graph.blocks), graph.indirect, graph.self_modifying
+    ([0], {6}, {0: 8, 2: 8})
+    >>> graph = ControlFlowGraph([3,7,1,7,6,6,0,99])
+    >>> graph.invalid, graph.self_modifying
+    ({6}, {2: 6})
+    >>> program = [109,100,21101,9,0,0,1105,1,10,99,109,5,1101,1,1,30,109,-5,2105,1,0]
+    >>> graph = ControlFlowGraph(program)
+    >>> [(b.start, [s.start for s in b.successors]) for b in graph.blocks.values()]
+    [(0, [10, 9]), (9, []), (10, [])]
+    >>> graph.calls
+    {6: 9}
+    >>> print(graph.listing())
+    block_0:
+         0  109,100                rb += 100
+         2  21101,9,0,0            add 9, 0 -> [rb+0]
+                                   ; writes relative, possibly into code
+         6  1105,1,10              jump_if_true 1, 10
+                                   ; calls block_10, returns to block_9
+    <BLANKLINE>
+    block_9:
+         9  99                     halt
+    <BLANKLINE>
+    block_10:
+        10  109,5                  rb += 5
+        12  1101,1,1,30            add 1, 1 -> [30]
+        16  109,-5                 rb += -5
+        18  2105,1,0               jump_if_true 1, [rb+0]
+                                   ; jumps somewhere unknown
+    """
+
+    def __init__(self, program, entries=(0,)):
+        self.program = list(program)
+        self.instructions = {}
+        self.calls = {}
+        self.indirect = set()
+        self.invalid = set()
+        self.blocks = {}
+
+        self.disassemble(entries)
+        self.code = set(a for a in self.invalid if 0 <= a < len(self.program))
+        for instruction in self.instructions.values():
+            self.code.update(range(instruction.address, instruction.following))
+        self.build_blocks(entries)
+
+        self.self_modifying = {}
+        self.relative_writes = set()
+        for address, instruction in sorted(self.instructions.items()):
+            written = instruction.written
+            if written and written[1] is Mode.RELATIVE:
+                self.relative_writes.add(address)
+            elif written and written[1] is Mode.ABSOLUTE and written[0] in self.code:
+                self.self_modifying[address] = written[0]
+
+    def decode(self, address):
+        if not 0 <= address < len(self.program):
+            return None
+        cells = self.program[address : address + 4]
+        try:
+            instruction = Instruction(address, cells)
+        except (KeyError, IndexError):
+            return None
+        if len(instruction.params) < instruction.size - 1:
+            return None
+        return instruction
+
+    def disassemble(self, entries):
+        pending = list(entries)
+        while pending:
+            address = pending.pop()
+            constants = set()
+            while address not in self.instructions:
+                instruction = self.decode(address)
+                if instruction is None:
+                    self.invalid.add(address)
+                    break
+
+                self.instructions[address] = instruction
+                if instruction.constant is not None:
+                    constants.add(instruction.constant)
+
+                if instruction.opcode == 99:
+                    break
+                if not instruction.jump:
+                    address = instruction.following
+                    continue
+
+                condition, target = instruction.condition, instruction.target
+                if condition is not False:
+                    if target is None:
+                        self.indirect.add(address)
+                    else:
+                        pending.append(target)
+                if condition is None:
+                    address = instruction.following
+                    continue
+                if condition and instruction.following in constants:
+                    self.calls[address] = instruction.following
+                    pending.append(instruction.following)
+                elif not condition:
+                    pending.append(instruction.following)
+                break
+
+    def build_blocks(self, entries):
+        leaders = set(a for a in entries if a in self.instructions)
+        for address, instruction in self.instructions.items():
+            if instruction.jump or instruction.opcode == 99:
+                leaders.add(instruction.following)
+            if instruction.target is not None:
+                leaders.add(instruction.target)
+        leaders &= set(self.instructions)
+
+        for start in sorted(leaders):
+            block = self.blocks[start] = Block(start)
+            address = start
+            while address in self.instructions:
+                instruction = self.instructions[address]
+                block.instructions.append(instruction)
+                address = instruction.following
+                if instruction.jump or instruction.opcode == 99 or address in leaders:
+                    break
+
+        for block in self.blocks.values():
+            last = block.instructions[-1]
+            targets = []
+            if last.jump:
+                if last.condition is not False and last.target is not None:
+                    targets.append(last.target)
+                if last.condition is not True:
+                    targets.append(last.following)
+                elif last.address in self.calls:
+                    targets.append(self.calls[last.address])
+            elif last.opcode != 99:
+                targets.append(last.following)
+
+            for target in targets:
+                if target in self.blocks:
+                    block.successors.append(self.blocks[target])
+                    self.blocks[target].predecessors.append(block)
+
+    def summary(self):
+        return (
+            f"{len(self.instructions)} instructions in {len(self.blocks)} blocks, "
+            f"{len(self.program) - len(self.code)} of {len(self.program)} cells "
+            f"data, {len(self.calls)} calls, {len(self.indirect)} indirect jumps, "
+            f"{len(self.self_modifying)} writes into code, "
+            f"{len(self.relative_writes)} relative writes that may be"
+        )
+
+    def listing(self, counts=None):
+        """
+        The program as text, block by block, with the cells that aren't
+        code as data in between. With `counts`, such as Profile.addresses(),
+        every instruction gets its count.
+        """
+        lines = []
+        data = []
+
+        def flush():
+            for i in range(0, len(data), 8):
+                address = data[i][0]
+                values = ",".join(str(v) for _, v in data[i : i + 8])
+                lines.append(f"{address:>6}  data {values}")
+            data.clear()
+
+        blank = "" if counts is None else " " * 12
+        address = 0
+        while address < len(self.program):
+            instruction = self.instructions.get(address)
+            if address in self.invalid:
+                flush()
+                lines.append(
+                    f"{address:>6}  {blank}{self.program[address]:<22} "
+                    "; not an instruction yet"
+                )
+            if instruction is None:
+                if address not in self.code:
+                    data.append((address, self.program[address]))
+                address += 1
+                continue
+
+            flush()
+            if address in self.blocks:
+                if lines:
+                    lines.append("")
+                lines.append(f"{self.blocks[address].name}:")
+
+            cells = ",".join(
+                str(c) for c in self.program[address : instruction.following]
+            )
+            text = str(instruction)
+            if instruction.opcode == 9:
+                text = f"rb += {operand(instruction.params[0], instruction.modes[0])}"
+            count = "" if counts is None else f"{counts.get(address, 0):>10}  "
+            lines.append(f"{address:>6}  {count}{cells:<22} {text}")
+
+            notes = []
+            if address in self.self_modifying:
+                target = self.self_modifying[address]
+                notes.append(f"; writes into code at {target}")
+            if address in self.calls:
+                callee = self.blocks.get(instruction.target)
+                returns = self.blocks.get(self.calls[address])
+                notes.append(
+                    f"; calls {callee.name if callee else '?'}, "
+                    f"returns to {returns.name if returns else '?'}"
+                )
+            elif address in self.indirect:
+                notes.append("; jumps somewhere unknown")
+            if address in self.relative_writes:
+                notes.append("; writes relative, possibly into code")
+            for note in notes:
+                lines.append(" " * (8 + len(count) + 23) + note)
+
+            address = instruction.following
+
+        flush()
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("program", type=argparse.FileType())
+    parser.add_argument(
+        "--entries", default="0", help="comma-separated addresses to start from"
+    )
+    parser.add_argument("--summary", action="store_true")
+    args = parser.parse_args()
+
+    program = IntcodeComputer.read_input(args.program.readline())
+    graph = ControlFlowGraph(program, IntcodeComputer.read_input(args.entries))
+    if not args.summary:
+        print(graph.listing())
+        print()
+    print(graph.summary())
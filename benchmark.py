@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+Instructions per second of intcode.IntcodeComputer on the day 9 BOOST
+program and the day 13 arcade, optionally side by side with the intcode.py
+of another git revision:
+
+    python benchmark.py
+    python benchmark.py --against HEAD~1
+    python benchmark.py --compiled
+    python benchmark.py --peephole --accelerate --micro
+    python benchmark.py --memoize
+    python benchmark.py --replay 13.trace
+    python benchmark.py --telemetry
+
+A trace recorded with IntcodeComputer.record() replays its inputs without
+the code that produced them, and is checked against its outputs first.
+"""
+
+import argparse
+import importlib.util
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+
+from workloads import ROOT, Joystick, read_program
+
+
+def make_computer(engine, program, inputs=(), peripheral=None, **options):
+    """
+    An engine.IntcodeComputer with `inputs` queued up, or with `peripheral`
+    as both of its queues. Engines from before Buffer need blocking queues
+    and a condition to notify when they read input.
+    """
+    if hasattr(engine, "Buffer"):
+        queues = [engine.Buffer(inputs), engine.Buffer(), None]
+    else:
+        queues = [queue.Queue(), queue.Queue(), threading.Condition()]
+        for value in inputs:
+            queues[0].put(value)
+
+    if peripheral is not None:
+        queues[:2] = peripheral, peripheral
+    return engine.IntcodeComputer(list(program), *queues, **options)
+
+
+def boost(engine, **options):
+    return make_computer(engine, read_program(9), [2], **options)
+
+
+def arcade(engine, **options):
+    program = read_program(13)
+    program[0] = 2
+    return make_computer(engine, program, peripheral=Joystick(), **options)
+
+
+def replay(trace, engine, **options):
+    computer = make_computer(engine, trace.program, trace.inputs, **options)
+    computer.pc, computer.relative_base = trace.pc, trace.relative_base
+    return computer
+
+
+WORKLOADS = {"day 9 BOOST": boost, "day 13 arcade": arcade}
+
+# Loops made of one kind of superinstruction each, as compiled Intcode
+# writes them, and a multiplication by repeated addition, that run LOOPS
+# times.
+LOOPS = 100000
+MICRO = {
+    "count+compare": [1001, 12, 1, 12, 1007, 12, LOOPS, 13, 1005, 13, 0, 99, 0, 0],
+    "compare+jump": [
+        *(101, 1, 16, 17, 1001, 17, 0, 16),
+        *(1007, 16, LOOPS, 18, 1005, 18, 0, 99, 0, 0, 0),
+    ],
+    "call+return": [
+        *(109, 100, 21101, 9, 0, 0, 1105, 1, 21),
+        *(1001, 28, 1, 28, 1007, 28, LOOPS, 29, 1005, 29, 2, 99),
+        *(109, 1, 109, -1, 2105, 1, 0, 0, 0),
+    ],
+    "multiply": [
+        *(1, 20, 21, 20, 1001, 22, 1, 22, 8, 22, 23, 24, 1006, 24, 0, 4, 20),
+        *(99, 0, 0, 0, 1234, 0, LOOPS, 0),
+    ],
+}
+
+
+def micro(program, engine, **options):
+    return make_computer(engine, program, **options)
+
+
+def load_engine(revision=None):
+    if revision is None:
+        path = os.path.join(ROOT, "intcode.py")
+    else:
+        source = subprocess.check_output(
+            ["git", "show", f"{revision}:intcode.py"], cwd=ROOT
+        )
+        handle, path = tempfile.mkstemp(suffix=".py")
+        with os.fdopen(handle, "wb") as f:
+            f.write(source)
+
+    name = f"intcode_{revision or 'working'}".replace("~", "_").replace("^", "_")
+    spec = importlib.util.spec_from_file_location(name, path)
+    engine = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(engine)
+
+    if revision is not None:
+        os.remove(path)
+    return engine
+
+
+def drive(engine, workload):
+    """
+    Run a workload through Telemetry.execute(), with the computer's own
+    queues as what it reads from and writes to, and return the Telemetry.
+    """
+    computer = workload(engine)
+    source, sink = computer.input_queue, computer.output_queue
+    telemetry = engine.Telemetry(computer, stream=sys.stdout)
+    machine = telemetry.execute()
+    value = None
+    while True:
+        try:
+            output = machine.send(value)
+        except StopIteration:
+            return telemetry
+
+        value = None
+        if output is None:
+            value = source.get()
+        else:
+            sink.put(output)
+
+
+def count_instructions(engine, workload):
+    computer = workload(engine)
+    status, steps = computer.run()
+    return steps
+
+
+def best_time(engine, options, workload, repeat):
+    best = None
+    for _ in range(repeat):
+        computer = workload(engine, **options)
+        start = time.perf_counter()
+        computer.run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--against", metavar="REVISION")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--compiled", action="store_true", help="also time the block compiler"
+    )
+    parser.add_argument(
+        "--peephole", action="store_true", help="also time superinstructions"
+    )
+    parser.add_argument(
+        "--accelerate", action="store_true", help="also time loop acceleration"
+    )
+    parser.add_argument(
+        "--memoize", action="store_true", help="also time memoized calls"
+    )
+    parser.add_argument(
+        "--micro", action="store_true", help="also time a loop per superinstruction"
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store_true",
+        help="also report where the time of each workload goes",
+    )
+    parser.add_argument(
+        "--replay",
+        action="append",
+        default=[],
+        metavar="TRACE",
+        help="also time a trace",
+    )
+    args = parser.parse_args()
+
+    current = load_engine()
+    for path in args.replay:
+        trace = current.Trace.load(path)
+        computer = replay(trace, current)
+        computer.run()
+        if not trace.check(computer.flush_output()):
+            parser.error(f"{path} doesn't replay to its recorded outputs")
+        WORKLOADS[os.path.basename(path)] = partial(replay, trace)
+
+    if args.micro:
+        for label, program in MICRO.items():
+            WORKLOADS[label] = partial(micro, program)
+
+    engines = [("working tree", current, {})]
+    if args.against:
+        engines.insert(0, (args.against, load_engine(args.against), {}))
+    if args.peephole:
+        engines.append(("peephole", current, {"peephole": True}))
+    if args.accelerate:
+        engines.append(("accelerated", current, {"accelerate": True}))
+    if args.memoize:
+        engines.append(("memoized", current, {"memoize": True}))
+    if args.compiled:
+        engines.append(("compiled", current, {"compiled": True}))
+
+    print(
+        f"{'workload':<16}{'engine':<16}{'instructions':>14}{'seconds':>10}{'instr/s':>12}"
+    )
+    for label, workload in WORKLOADS.items():
+        instructions = count_instructions(current, workload)
+        for name, engine, options in engines:
+            seconds = best_time(engine, options, workload, args.repeat)
+            print(
+                f"{label:<16}{name:<16}{instructions:>14}"
+                f"{seconds:>10.3f}{instructions / seconds:>12,.0f}"
+            )
+
+    if args.telemetry:
+        print()
+        for label, workload in WORKLOADS.items():
+            print(f"{label:<16}", end="")
+            drive(current, workload).dump()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import os
+import time
+
+# The program, task and cancellation flag of a worker process.
+WORKER = {}
+
+# How many seconds of jobs a farm runs in this process before it starts
+# its worker processes, which take longer than that to start.
+SERIAL_SECONDS = 0.25
+
+
+def warm_pool(program):
+    # Farms of tasks that don't run Intcode shouldn't have to wait for
+    # intcode to build its handlers.
+    from intcode import ComputerPool, Image, load_image
+
+    if not isinstance(program, Image):
+        program = load_image(program)
+    return ComputerPool(program)
+
+
+def run_program(pool, inputs):
+    """
+    The default task: run the program of a warm_pool() on `inputs` and
+    return its outputs.
+    """
+    return pool.run(inputs)
+
+
+def setup_worker(program, setup, task, cancelled):
+    if setup:
+        program = setup(program)
+    WORKER.update(program=program, task=task, cancelled=cancelled)
+
+
+def work(job):
+    if WORKER["cancelled"] is not None and WORKER["cancelled"].is_set():
+        return job, None
+    return job, WORKER["task"](WORKER["program"], job)
+
+
+class Farm(object):
+    """
+    Runs independent jobs against one program on a pool of worker
+    processes. The program is sent to each worker once, when the pool
+    starts, and turned into `setup(program)` there if `setup` is given.
+    Each job is then just `task(program, job)`. By default a job is a list
+    of inputs and its result is the list of outputs, run on a warm pool of
+    computers. Jobs go out in chunks. They run in this process until they
+    have taken `serial` seconds, and the pool only starts for the jobs that
+    are left then, so that small searches don't pay for starting it. With
+    a single process there is no pool at all.
+
+    >>> program = [3,9,8,9,10,9,4,9,99,-1,8]
+    >>> for serial in (SERIAL_SECONDS, 0):
+    ...     with Farm(program, processes=2, serial=serial) as farm:
+    ...         list(farm.map([[7], [8]]))
+    ...         farm.find([[6], [8], [7], [8]], lambda outputs: outputs == [1])
+    ...         farm.pool is None
+    [([7], [0]), ([8], [1])]
+    ([8], [1])
+    True
+    [([7], [0]), ([8], [1])]
+    ([8], [1])
+    False
+    """
+
+    def __init__(
+        self,
+        program,
+        task=run_program,
+        setup=None,
+        processes=None,
+        chunksize=None,
+        serial=SERIAL_SECONDS,
+    ):
+        if setup is None and task is run_program:
+            setup = warm_pool
+
+        self.program = program
+        self.task = task
+        self.setup = setup
+        self.processes = (
+            processes or getattr(os, "process_cpu_count", os.cpu_count)() or 1
+        )
+        self.chunksize = chunksize
+        self.serial = serial
+        self.cancelled = None
+        self.pool = None
+        self.local = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        self.cancelled = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(
+            self.processes,
+            setup_worker,
+            (self.program, self.setup, self.task, self.cancelled),
+        )
+
+    def run(self, job):
+        """
+        Run `job` in this process.
+        """
+        if self.local is None:
+            self.local = self.setup(self.program) if self.setup else self.program
+        return self.task(self.local, job)
+
+    def close(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def map(self, jobs, ordered=True):
+        """
+        Yield `(job, result)` for every job, either in the order of `jobs`
+        or as they finish.
+        """
+        jobs = iter(jobs)
+        if not self.pool:
+            deadline = time.monotonic() + self.serial
+            for job in jobs:
+                yield job, self.run(job)
+                if self.processes > 1 and time.monotonic() > deadline:
+                    break
+            else:
+                return
+            self.start()
+
+        jobs = list(jobs)
+        chunksize = self.chunksize or max(1, len(jobs) // (4 * self.processes))
+        results = self.pool.imap if ordered else self.pool.imap_unordered
+        yield from results(work, jobs, chunksize)
+
+    def find(self, jobs, predicate):
+        """
+        Return the first `(job, result)` in the order of `jobs` whose result
+        satisfies `predicate`, or None. Jobs that haven't started by then are
+        skipped.
+        """
+        results = self.map(jobs)
+        found = None
+        for job, result in results:
+            if predicate(result):
+                found = (job, result)
+                break
+
+        if self.pool is not None:
+            self.cancelled.set()
+            for _ in results:
+                pass
+            self.cancelled.clear()
+        results.close()
+
+        return found
@@ -1,9 +1,18 @@
 #!/usr/bin/env python
 
+import atexit
+import builtins
+import hashlib
+import marshal
+import mmap
 import operator
-import queue
+import os
+import sys
 import threading
-from collections import defaultdict
+import time
+import types
+from array import array
+from collections import OrderedDict, defaultdict, deque
 from enum import IntEnum
 from itertools import permutations
 from textwrap import dedent
@@ -31,27 +40,1362 @@ class HaltException(Exception):
     pass
 
 
+class InputRequired(Exception):
+    pass
+
+
+class Status(IntEnum):
+    HALTED = 0
+    NEEDS_INPUT = 1
+    OUTPUT_READY = 2
+    BUDGET_EXHAUSTED = 3
+
+
+# How many instructions the interpreter retires between looks at the clock,
+# minus one.
+DEADLINE_INTERVAL = 1023
+
+
+class Buffer(deque):
+    """
+    The parts of queue.Queue that IntcodeComputer uses, for a computer that
+    runs in the calling thread. Instead of blocking, get() on an empty
+    buffer raises InputRequired.
+
+    >>> buffer = Buffer([1])
+    >>> buffer.put(2)
+    >>> buffer.get(), buffer.get()
+    (1, 2)
+    >>> buffer.get()
+    Traceback (most recent call last):
+    ...
+    intcode.InputRequired
+    """
+
+    def put(self, value):
+        self.append(value)
+
+    def get(self):
+        try:
+            return self.popleft()
+        except IndexError:
+            raise InputRequired()
+
+    def empty(self):
+        return not self
+
+    def drain(self):
+        values = list(self)
+        self.clear()
+        return values
+
+
+class Channel(object):
+    """
+    A queue from one producer thread to one consumer thread, and the default
+    input and output of an IntcodeComputer. Values go through a deque, whose
+    append and popleft need no lock, so a lock is only taken when the
+    consumer finds the channel empty and parks, and by the producer only to
+    wake a parked consumer.
+
+    >>> channel = Channel([1])
+    >>> channel.put_many([2, 3, 4])
+    >>> channel.get(), channel.get_many(2), channel.drain(), channel.empty()
+    (1, [2, 3], [4], True)
+    >>> thread = threading.Thread(target=lambda: channel.put_many([5, 6]))
+    >>> thread.start()
+    >>> channel.get_many(2)
+    [5, 6]
+    >>> thread.join()
+    """
+
+    def __init__(self, values=()):
+        self.values = deque(values)
+        self.parked = False
+        self.ready = threading.Condition()
+
+    def __len__(self):
+        return len(self.values)
+
+    def put(self, value):
+        self.values.append(value)
+        if self.parked:
+            self.wake()
+
+    def put_many(self, values):
+        self.values.extend(values)
+        if self.parked:
+            self.wake()
+
+    def wake(self):
+        with self.ready:
+            self.ready.notify()
+
+    def get(self):
+        try:
+            return self.values.popleft()
+        except IndexError:
+            pass
+
+        self.wait()
+        return self.values.popleft()
+
+    def wait(self):
+        # The consumer says it's parked before it looks at the deque for the
+        # last time, so a producer that appends after that look sees it.
+        with self.ready:
+            self.parked = True
+            try:
+                while not self.values:
+                    self.ready.wait()
+            finally:
+                self.parked = False
+
+    def get_many(self, count):
+        return [self.get() for _ in range(count)]
+
+    def drain(self):
+        """
+        Take everything in the channel without waiting.
+        """
+        values = []
+        try:
+            while True:
+                values.append(self.values.popleft())
+        except IndexError:
+            return values
+
+    def empty(self):
+        return not self.values
+
+
+class MeteredChannel(Channel):
+    """
+    A Channel that counts the values that go through it, the most it held
+    at once, and how long its consumer spent waiting for values. Channels
+    have no size limit, so producers never wait.
+
+    >>> channel = MeteredChannel()
+    >>> channel.put_many([1, 2, 3])
+    >>> channel.get(), channel.drain()
+    (1, [2, 3])
+    >>> channel.sent, channel.received, channel.high_water, channel.waits
+    (3, 3, 3, 0)
+    """
+
+    def __init__(self, values=()):
+        super().__init__(values)
+        self.sent = len(self.values)
+        self.received = 0
+        self.high_water = len(self.values)
+        self.waits = 0
+        self.blocked = 0.0
+
+    def put(self, value):
+        super().put(value)
+        self.sent += 1
+        self.high_water = max(self.high_water, len(self.values))
+
+    def put_many(self, values):
+        values = list(values)
+        super().put_many(values)
+        self.sent += len(values)
+        self.high_water = max(self.high_water, len(self.values))
+
+    def get(self):
+        value = super().get()
+        self.received += 1
+        return value
+
+    def wait(self):
+        start = time.perf_counter()
+        super().wait()
+        self.waits += 1
+        self.blocked += time.perf_counter() - start
+
+    def drain(self):
+        values = super().drain()
+        self.received += len(values)
+        return values
+
+
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+
+def make_page(values=()):
+    """
+    >>> make_page([1, 2])[:3]
+    array('q', [1, 2, 0])
+    >>> make_page([2 ** 64])[:2]
+    [18446744073709551616, 0]
+    """
+    try:
+        page = array("q", values)
+    except OverflowError:
+        return list(values) + [0] * (PAGE_SIZE - len(values))
+
+    page.frombytes(bytes(8 * (PAGE_SIZE - len(page))))
+    return page
+
+
+class Memory(object):
+    """
+    Intcode memory made of fixed-size pages of 64-bit cells, allocated the
+    first time something is written to them. A page that has to hold a value
+    too big for 64 bits is turned into a list of Python ints.
+
+    >>> memory = Memory([1, 2, 3])
+    >>> memory[1], memory[100000]
+    (2, 0)
+    >>> memory[100000] = 1219070632396864 ** 2
+    >>> memory[100000]
+    1486133206772489918753597034496
+    >>> sorted(memory.pages)
+    [0, 97]
+    >>> len(memory)
+    100001
+    >>> memory[-1]
+    Traceback (most recent call last):
+    ...
+    IndexError: Negative memory address: -1
+    """
+
+    def __init__(self, program=()):
+        self.pages = {}
+        self.shared = {}
+        self.loaded = len(program)
+        self.watched = set()
+        self.watcher = None
+        self.journal = None
+
+        for start in range(0, len(program), PAGE_SIZE):
+            self.pages[start >> PAGE_BITS] = make_page(
+                program[start : start + PAGE_SIZE]
+            )
+
+    def __getitem__(self, address):
+        try:
+            return self.pages[address >> PAGE_BITS][address & PAGE_MASK]
+
+        except KeyError:
+            if address < 0:
+                raise IndexError(f"Negative memory address: {address}")
+            if address >> PAGE_BITS in self.shared:
+                return self.unshare(address >> PAGE_BITS)[address & PAGE_MASK]
+            return 0
+
+    def __setitem__(self, address, value):
+        if self.journal is not None:
+            self.journal.append((address, self[address]))
+
+        number = address >> PAGE_BITS
+        try:
+            page = self.pages[number]
+
+        except KeyError:
+            if address < 0:
+                raise IndexError(f"Negative memory address: {address}")
+            if number in self.shared:
+                page = self.unshare(number)
+            else:
+                page = self.pages[number] = make_page()
+
+        try:
+            page[address & PAGE_MASK] = value
+
+        except OverflowError:
+            page = self.pages[number] = list(page)
+            page[address & PAGE_MASK] = value
+
+        if address in self.watched:
+            self.changed(address)
+
+    def fork(self):
+        """
+        A copy of this memory that shares its pages with it. Either side
+        copies a shared page the first time it touches it, so forking
+        doesn't copy any cells.
+
+        >>> memory = Memory([1, 2, 3])
+        >>> copy = memory.fork()
+        >>> copy[1] = 5
+        >>> memory[1], copy[1], copy[2]
+        (2, 5, 3)
+        >>> sorted(memory.pages), sorted(memory.shared), sorted(copy.pages)
+        ([0], [], [0])
+        """
+        self.shared.update(self.pages)
+        self.pages.clear()
+
+        copy = Memory()
+        copy.shared = dict(self.shared)
+        copy.loaded = self.loaded
+        copy.watched = set(self.watched)
+        if self.journal is not None:
+            copy.journal = list(self.journal)
+        return copy
+
+    def peek(self, address):
+        """
+        Read a cell without taking a copy of a shared page.
+        """
+        number = address >> PAGE_BITS
+        page = self.pages.get(number) or self.shared.get(number)
+        return page[address & PAGE_MASK] if page else 0
+
+    def unshare(self, number):
+        page = self.shared.pop(number)[:]
+        self.pages[number] = page
+        return page
+
+    def changed(self, address):
+        """
+        Report a write to a cell in `watched` to `watcher`. Each address is
+        reported once; add it to `watched` again to hear about the next write.
+
+        >>> memory = Memory([1, 2, 3])
+        >>> memory.watcher = print
+        >>> memory.watched.add(1)
+        >>> memory[1] = 5
+        1
+        >>> memory[1] = 6
+        """
+        self.watched.discard(address)
+        if self.watcher:
+            self.watcher(address)
+
+    def __len__(self):
+        """
+        One past the highest address that is either part of the loaded
+        program or holds a non-zero value.
+        """
+        pages = {**self.shared, **self.pages}
+        for number in sorted(pages, reverse=True):
+            page = pages[number]
+            if isinstance(page, array):
+                used = (len(page.tobytes().rstrip(b"\0")) + 7) // 8
+            else:
+                used = next((i + 1 for i in range(PAGE_SIZE - 1, -1, -1) if page[i]), 0)
+
+            if used:
+                return max(self.loaded, (number << PAGE_BITS) + used)
+
+        return self.loaded
+
+    def dump(self):
+        """
+        The first len(self) cells, so trailing zeros past the loaded program
+        are left out.
+
+        >>> Memory([1, 2, 3]).dump()
+        [1, 2, 3]
+        """
+        size = len(self)
+        cells = []
+        for number in range((size + PAGE_MASK) >> PAGE_BITS):
+            cells.extend(
+                self.pages.get(number) or self.shared.get(number) or make_page()
+            )
+
+        del cells[size:]
+        return cells
+
+
+# opcode: (name, parameter count, index of the written parameter, body)
+INSTRUCTIONS = {
+    1: ("add", 3, 2, "result = operand0 + operand1"),
+    2: ("mul", 3, 2, "result = operand0 * operand1"),
+    3: ("load", 1, 0, "result = computer.next_input()"),
+    4: ("print", 1, None, "computer.output_queue.put(operand0)"),
+    5: ("jump_if_true", 2, None, "if operand0 > 0:\n    return operand1"),
+    6: ("jump_if_false", 2, None, "if operand0 == 0:\n    return operand1"),
+    7: ("less_than", 3, 2, "result = 1 if operand0 < operand1 else 0"),
+    8: ("equals", 3, 2, "result = 1 if operand0 == operand1 else 0"),
+    9: ("set_relative_base", 1, None, "computer.relative_base += operand0"),
+    99: ("halt", 0, None, "raise HaltException()"),
+}
+
+PARAMETER_COUNTS = {opcode: spec[1] for opcode, spec in INSTRUCTIONS.items()}
+
+
+def address_source(param, mode, base):
+    if mode is Mode.RELATIVE:
+        return f"{base} + {param}"
+    return param
+
+
+def read_source(name, param, mode, base="computer.relative_base"):
+    """
+    Python statements that load the value of a `mode` parameter into `name`.
+    `param` is either the name of a variable or a known int, and `base` is
+    the expression for the relative base.
+
+    >>> print("\\n".join(read_source("operand0", "param0", Mode.RELATIVE)))
+    address = computer.relative_base + param0
+    try:
+        operand0 = pages[address >> 10][address & 1023]
+    except KeyError:
+        operand0 = memory[address]
+    >>> print("\\n".join(read_source("operand0", 2049, Mode.ABSOLUTE)))
+    try:
+        operand0 = pages[2][1]
+    except KeyError:
+        operand0 = memory[2049]
+    """
+    if mode is Mode.IMMEDIATE:
+        return [f"{name} = {param}"]
+
+    if mode is Mode.ABSOLUTE and isinstance(param, int):
+        return [
+            "try:",
+            f"    {name} = pages[{param >> PAGE_BITS}][{param & PAGE_MASK}]",
+            "except KeyError:",
+            f"    {name} = memory[{param}]",
+        ]
+
+    return [
+        f"address = {address_source(param, mode, base)}",
+        "try:",
+        f"    {name} = pages[address >> {PAGE_BITS}][address & {PAGE_MASK}]",
+        "except KeyError:",
+        f"    {name} = memory[address]",
+    ]
+
+
+def write_source(value, param, mode, base="computer.relative_base", journaled=False):
+    """
+    Python statements that store `value` through a `mode` parameter, leaving
+    the address written to in `address`. A `journaled` write goes through
+    Memory.__setitem__, which records the old value.
+    """
+    if mode is Mode.IMMEDIATE:
+        return ['raise Exception("Can\'t write to IMMEDIATE mode parameters.")']
+
+    if journaled:
+        address = address_source(param, mode, base)
+        return [f"address = {address}", f"memory[address] = {value}"]
+
+    if mode is Mode.ABSOLUTE and isinstance(param, int):
+        page, offset = param >> PAGE_BITS, param & PAGE_MASK
+        lines = [f"address = {param}", "try:", f"    pages[{page}][{offset}] = {value}"]
+    else:
+        lines = [
+            f"address = {address_source(param, mode, base)}",
+            "try:",
+            f"    pages[address >> {PAGE_BITS}][address & {PAGE_MASK}] = {value}",
+        ]
+
+    return lines + [
+        "except (KeyError, OverflowError):",
+        f"    memory[address] = {value}",
+        "else:",
+        "    if address in memory.watched:",
+        "        memory.changed(address)",
+    ]
+
+
+def specialize(opcode, modes, journaled=False):
+    """
+    Compile a handler for one opcode with its parameter modes baked in. It
+    takes the computer and the instruction's parameters and returns the next
+    pc. A `journaled` handler records the old value of the cell it writes.
+
+    >>> handler = specialize(1, (Mode.IMMEDIATE, Mode.RELATIVE, Mode.ABSOLUTE))
+    >>> handler.__name__
+    'op_add_021'
+    >>> print(handler.source)
+    def op_add_021(computer, params):
+        memory = computer.memory
+        pages = memory.pages
+        param0, param1, param2 = params
+        operand0 = param0
+        address = computer.relative_base + param1
+        try:
+            operand1 = pages[address >> 10][address & 1023]
+        except KeyError:
+            operand1 = memory[address]
+        result = operand0 + operand1
+        address = param2
+        try:
+            pages[address >> 10][address & 1023] = result
+        except (KeyError, OverflowError):
+            memory[address] = result
+        else:
+            if address in memory.watched:
+                memory.changed(address)
+        return computer.pc + 4
+    <BLANKLINE>
+    """
+    name, count, written, body = INSTRUCTIONS[opcode]
+    params = [f"param{i}" for i in range(count)]
+    digits = "".join(str(int(mode)) for mode in reversed(modes[:count]))
+    function = f"op_{name}_{digits}" if count else f"op_{name}"
+    if journaled:
+        function += "_journaled"
+
+    lines = ["memory = computer.memory", "pages = memory.pages"]
+    if count == 1:
+        lines.append("(param0,) = params")
+    elif count:
+        lines.append(f"{', '.join(params)} = params")
+    for i in range(count):
+        if i != written:
+            lines += read_source(f"operand{i}", params[i], modes[i])
+    lines += body.split("\n")
+    if written is not None:
+        lines += write_source(
+            "result", params[written], modes[written], journaled=journaled
+        )
+    if opcode != 99:
+        lines.append(f"return computer.pc + {count + 1}")
+
+    source = f"def {function}(computer, params):\n"
+    source += "".join(f"    {line}\n" for line in lines)
+
+    namespace = {"HaltException": HaltException}
+    exec(compile(source, f"<intcode {function}>", "exec"), namespace)
+    handler = namespace[function]
+    handler.source = source
+    return handler
+
+
+def build_handlers(journaled=False):
+    """
+    Map every intcode, modes included, to its specialized handler.
+
+    >>> handlers = build_handlers()
+    >>> handlers[21202].__name__, handlers[1101].__name__, handlers[99].__name__
+    ('op_mul_212', 'op_add_011', 'op_halt')
+    >>> handlers[1104] is handlers[104]
+    True
+    """
+    handlers = {}
+    specialized = {}
+    for opcode, (name, count, written, body) in INSTRUCTIONS.items():
+        for digits in range(27):
+            modes = (Mode(digits % 3), Mode(digits // 3 % 3), Mode(digits // 9))
+            key = (opcode, modes[:count])
+            if key not in specialized:
+                specialized[key] = specialize(opcode, modes, journaled)
+
+            intcode = (modes[2] * 100 + modes[1] * 10 + modes[0]) * 100 + opcode
+            handlers[intcode] = specialized[key]
+
+    return handlers
+
+
+HANDLERS = build_handlers()
+JOURNALED_HANDLERS = {}
+
+
+def journaled_handlers():
+    if not JOURNALED_HANDLERS:
+        JOURNALED_HANDLERS.update(build_handlers(journaled=True))
+    return JOURNALED_HANDLERS
+
+
+def same_cell(mode, param, other_mode, other_param):
+    return mode == other_mode and mode != Mode.IMMEDIATE and param == other_param
+
+
+def unconditional(instruction):
+    opcode, op, modes, params = instruction
+    return (
+        opcode in (5, 6)
+        and modes[0] == Mode.IMMEDIATE
+        and (params[0] > 0) == (opcode == 5)
+    )
+
+
+def match_superinstruction(instructions):
+    """
+    The superinstruction that the decoded `instructions` in a row start
+    with, as its name, the number of instructions it takes, and the operands
+    it can take from the result of an earlier instruction instead of memory.
+    Or None.
+
+    >>> computer = IntcodeComputer([1001,20,1,20,1007,20,9,21,1005,21,0,99])
+    >>> match_superinstruction([computer.decode(pc) for pc in (0, 4, 8)])
+    ('count_compare_jump', 3, {(2, 0): 'result1', (1, 0): 'result0'})
+    >>> match_superinstruction([computer.decode(pc) for pc in (4, 8)])
+    ('compare_jump', 2, {(1, 0): 'result0'})
+    """
+
+    def compare_jump(first, second):
+        return (
+            first[0] in (7, 8)
+            and second[0] in (5, 6)
+            and same_cell(first[2][2], first[3][2], second[2][0], second[3][0])
+        )
+
+    if len(instructions) >= 3 and compare_jump(instructions[1], instructions[2]):
+        opcode, op, modes, params = instructions[0]
+        compare = instructions[1]
+        if (
+            opcode == 1
+            and same_cell(modes[2], params[2], modes[0], params[0])
+            and modes[1] == Mode.IMMEDIATE
+        ):
+            forwards = {(2, 0): "result1"}
+            for i in (0, 1):
+                if same_cell(modes[2], params[2], compare[2][i], compare[3][i]):
+                    forwards[1, i] = "result0"
+            return "count_compare_jump", 3, forwards
+
+    if len(instructions) < 2:
+        return None
+
+    first, second = instructions[:2]
+    if compare_jump(first, second):
+        return "compare_jump", 2, {(1, 0): "result0"}
+
+    opcode, op, modes, params = first
+    if unconditional(second) and second[2][1] == Mode.IMMEDIATE:
+        if opcode in (1, 2) and modes[0] == modes[1] == Mode.IMMEDIATE:
+            return "call", 2, {}
+    if unconditional(second) and second[2][1] == Mode.RELATIVE:
+        if opcode == 9 and modes[0] == Mode.IMMEDIATE:
+            return "return", 2, {}
+
+    return None
+
+
+SUPERINSTRUCTIONS = {}
+
+
+def superinstruction(name, intcodes, forwards):
+    """
+    Compile a handler that executes the instructions with `intcodes` one
+    after the other, like the specialized handlers do one at a time. It
+    takes the parameters of all of them in one tuple and returns the next
+    pc. Operands in `forwards` are taken from the result of an earlier
+    instruction. If an instruction writes into the cells of the ones after
+    it, the handler returns after it and adds the instructions it skipped
+    to `computer.skipped`.
+
+    >>> handler = superinstruction("compare_jump", (1007, 1005), {(1, 0): "result0"})
+    >>> print(handler.source)
+    def op_compare_jump_1007_1005(computer, params):
+        memory = computer.memory
+        pages = memory.pages
+        pc = computer.pc
+        param0, param1, param2, param3, param4 = params
+        address = param0
+        try:
+            operand0 = pages[address >> 10][address & 1023]
+        except KeyError:
+            operand0 = memory[address]
+        operand1 = param1
+        result = 1 if operand0 < operand1 else 0
+        address = param2
+        try:
+            pages[address >> 10][address & 1023] = result
+        except (KeyError, OverflowError):
+            memory[address] = result
+        else:
+            if address in memory.watched:
+                memory.changed(address)
+        result0 = result
+        if pc <= address < pc + 7:
+            computer.skipped += 1
+            return pc + 4
+        operand0 = result0
+        operand1 = param4
+        if operand0 > 0:
+            return operand1
+        return pc + 7
+    <BLANKLINE>
+    """
+    key = (intcodes, tuple(sorted(forwards.items())))
+    try:
+        return SUPERINSTRUCTIONS[key]
+    except KeyError:
+        pass
+
+    end = sum(PARAMETER_COUNTS[intcode % 100] + 1 for intcode in intcodes)
+    lines = ["memory = computer.memory", "pages = memory.pages", "pc = computer.pc"]
+    params = []
+    following = 0
+    for index, intcode in enumerate(intcodes):
+        opcode = intcode % 100
+        count, written, body = INSTRUCTIONS[opcode][1:]
+        modes = parse_modes(intcode // 100)
+        names = [f"param{len(params) + i}" for i in range(count)]
+        params += names
+        following += count + 1
+
+        for i in range(count):
+            if (index, i) in forwards:
+                lines.append(f"operand{i} = {forwards[index, i]}")
+            elif i != written:
+                lines += read_source(f"operand{i}", names[i], modes[i])
+        lines += body.split("\n")
+
+        if written is not None:
+            lines += write_source("result", names[written], modes[written])
+            lines.append(f"result{index} = result")
+            skipped = len(intcodes) - index - 1
+            if skipped:
+                lines += [
+                    f"if pc <= address < pc + {end}:",
+                    f"    computer.skipped += {skipped}",
+                    f"    return pc + {following}",
+                ]
+
+    lines.insert(3, f"{', '.join(params)} = params")
+    lines.append(f"return pc + {end}")
+
+    function = f"op_{name}_{'_'.join(map(str, intcodes))}"
+    source = f"def {function}(computer, params):\n"
+    source += "".join(f"    {line}\n" for line in lines)
+
+    namespace = {"HaltException": HaltException}
+    exec(compile(source, f"<intcode {function}>", "exec"), namespace)
+    handler = SUPERINSTRUCTIONS[key] = namespace[function]
+    handler.source = source
+    return handler
+
+
+class Unaccelerated(Exception):
+    pass
+
+
+def exit_iteration(start, step, relation):
+    """
+    The first k >= 0 for which `start + step * k` is >= 0, == 0 or != 0,
+    depending on `relation`, or None if there is none.
+
+    >>> exit_iteration(-10, 3, ">="), exit_iteration(-9, 3, "=="), exit_iteration(-10, 3, "==")
+    (4, 3, None)
+    """
+    if relation == ">=":
+        if start >= 0:
+            return 0
+        if step <= 0:
+            return None
+        return (-start + step - 1) // step
+
+    if relation == "==":
+        if start == 0:
+            return 0
+        if step == 0 or -start % step or -start // step < 0:
+            return None
+        return -start // step
+
+    if start != 0:
+        return 0
+    return 1 if step != 0 else None
+
+
+class Loop(object):
+    """
+    Straight-line code from `start` that jumps back to `start` from `jump`
+    for as long as some condition holds. If every cell the loop writes ends
+    each iteration as a cell that goes up by the same amount every
+    iteration, plus a constant, and the condition compares such cells, then
+    the iteration it exits in can be worked out instead of run.
+    """
+
+    def __init__(self, start, jump, body):
+        self.start = start
+        self.jump = jump
+        self.body = body
+        self.size = len(body)
+
+    @classmethod
+    def find(cls, computer, start, jump):
+        """
+        The Loop from `start` to the jump at `jump`, or None if there's
+        anything in between that isn't arithmetic or a comparison, that
+        isn't an instruction yet, or that may write into the loop.
+
+        >>> program = [3,50,21101,1100,1,10,1001,50,-1,50,0,0,0,60,21101,0,0,10,
+        ...     1005,50,2,4,50,99]
+        >>> computer = IntcodeComputer(program, Buffer([3]), Buffer())
+        >>> Loop.find(computer, 2, 18) is None
+        True
+        >>> list(IntcodeComputer(program, accelerate=True).execute([3]))
+        [0]
+        """
+        body = []
+        pc = start
+        while pc < jump:
+            try:
+                instruction = computer.decoded.get(pc) or computer.decode(pc)
+            except Exception:
+                return None
+            opcode, op, modes, params = instruction
+            if opcode not in (1, 2, 7, 8) or modes[2] == Mode.RELATIVE:
+                return None
+            if start <= params[2] < jump + 3:
+                return None
+            body.append(instruction)
+            pc += len(params) + 1
+
+        if pc != jump:
+            return None
+        body.append(computer.decoded.get(jump) or computer.decode(jump))
+        return cls(start, jump, body)
+
+    def accelerate(self, computer):
+        """
+        Run the rest of the loop, from the start of an iteration, by
+        writing the state it exits with. Returns the number of iterations
+        that took, or None if the loop isn't one that can be.
+
+        >>> program = [1001,12,1,12,1007,12,10**9,13,1005,13,0,99,0,0]
+        >>> computer = IntcodeComputer(program, accelerate=True)
+        >>> computer.run(), computer.memory[12], computer.pc
+        ((<Status.HALTED: 0>, 3000000001), 1000000000, 11)
+        >>> program = [1,20,21,20,1001,22,1,22,8,22,23,24,1006,24,0,4,20,99,0,0,0,1234,0,5678,0]
+        >>> [list(IntcodeComputer(program, accelerate=a).execute()) for a in (False, True)]
+        [[7006652], [7006652]]
+        """
+        try:
+            exits, values, flags = self.evaluate(computer)
+        except Unaccelerated:
+            return None
+
+        memory = computer.memory
+        start = {cell: memory[cell] for cell in values}
+        steps = {cell: step for cell, (symbol, step) in values.items()}
+
+        def value(symbol, offset, k):
+            if symbol is None:
+                return offset
+            return start[symbol] + k * steps[symbol] + offset
+
+        for cell, (symbol, offset) in values.items():
+            memory[cell] = value(symbol, offset, exits)
+        for cell, (opcode, x, y) in flags.items():
+            difference = value(*x, exits) - value(*y, exits)
+            memory[cell] = int(difference < 0 if opcode == 7 else difference == 0)
+
+        return exits + 1
+
+    def evaluate(self, computer):
+        """
+        Run one iteration on symbols: every cell the loop writes is read as
+        (cell, 0), its value at the start of the iteration, and every other
+        cell as (None, value). Returns the iteration the loop exits in, and
+        what the cells it writes are at the end of an iteration, either as
+        (cell, offset) or, for comparisons, as (opcode, x, y).
+        """
+        base = computer.relative_base
+        memory = computer.memory
+
+        def address(param, mode):
+            return base + param if mode == Mode.RELATIVE else param
+
+        written = set()
+        for opcode, op, modes, params in self.body[:-1]:
+            cell = address(params[2], modes[2])
+            if self.start <= cell < self.jump + 3:
+                raise Unaccelerated()
+            written.add(cell)
+
+        values = {}
+        flags = {}
+
+        def read(param, mode, flag=False):
+            if mode == Mode.IMMEDIATE:
+                return None, param
+            cell = address(param, mode)
+            if cell in flags:
+                if not flag:
+                    raise Unaccelerated()
+                return flags[cell]
+            if cell in values:
+                return values[cell]
+            if cell in written:
+                return cell, 0
+            return None, memory[cell]
+
+        for opcode, op, modes, params in self.body[:-1]:
+            x, y = read(params[0], modes[0]), read(params[1], modes[1])
+            cell = address(params[2], modes[2])
+            values.pop(cell, None)
+            flags.pop(cell, None)
+            if opcode == 7 or opcode == 8:
+                flags[cell] = (opcode, x, y)
+            elif opcode == 1 and (x[0] is None or y[0] is None):
+                values[cell] = (x[0] if x[0] is not None else y[0], x[1] + y[1])
+            elif opcode == 2 and x[0] is None and y[0] is None:
+                values[cell] = (None, x[1] * y[1])
+            elif opcode == 2 and (x == (None, 1) or y == (None, 1)):
+                values[cell] = y if x == (None, 1) else x
+            elif opcode == 2 and (x == (None, 0) or y == (None, 0)):
+                values[cell] = (None, 0)
+            else:
+                raise Unaccelerated()
+
+        opcode, op, modes, params = self.body[-1]
+        if read(params[1], modes[1]) != (None, self.start):
+            raise Unaccelerated()
+        condition = read(params[0], modes[0], flag=True)
+
+        # Every cell the state depends on has to go up by a constant step.
+        def stepped(symbol):
+            return symbol is None or values.get(symbol, (None,))[0] == symbol
+
+        operands = list(values.values())
+        for compare, x, y in flags.values():
+            operands += [x, y]
+        if len(condition) == 3:
+            operands += condition[1:]
+        else:
+            operands.append(condition)
+        if not all(stepped(symbol) for symbol, offset in operands):
+            raise Unaccelerated()
+
+        def affine(symbol, offset):
+            if symbol is None:
+                return offset, 0
+            return memory[symbol] + offset, values[symbol][1]
+
+        if len(condition) == 3:
+            compare, x, y = condition
+            (a, da), (b, db) = affine(*x), affine(*y)
+            u, v = a - b, da - db
+            if compare == 7:
+                # The flag is set while u + v * k < 0.
+                relation = ">=" if opcode == 5 else "<"
+            else:
+                relation = "!=" if opcode == 5 else "=="
+        else:
+            u, v = affine(*condition)
+            relation = "<=" if opcode == 5 else "!="
+
+        # What the loop exits on, as something that's >= 0, == 0 or != 0.
+        if relation == "<":
+            u, v, relation = -u - 1, -v, ">="
+        elif relation == "<=":
+            u, v, relation = -u, -v, ">="
+
+        exits = exit_iteration(u, v, relation)
+        if exits is None:
+            raise Unaccelerated()
+        return exits, values, flags
+
+
+class Call(object):
+    """
+    A call being run under run_memoized(): the routine at `entry`, whose
+    frame of `size` cells, the return address and then the arguments,
+    starts at `base`. It collects the value of every cell the call reads
+    before writing it, and the final value of every cell it writes,
+    including those of the calls it makes, and the lowest cell it reached
+    relative to the base.
+    """
+
+    def __init__(self, entry, base, size, start, returns):
+        self.entry = entry
+        self.base = base
+        self.size = size
+        self.start = start
+        self.returns = returns
+        self.reads = {}
+        self.writes = {}
+        self.lowest = base
+
+    def read(self, cell, memory):
+        if cell not in self.reads and cell not in self.writes:
+            self.reads[cell] = memory[cell]
+
+    def merge(self, reads, writes, lowest):
+        """
+        Add what a call made from this one read and wrote.
+        """
+        for cell, value in reads.items():
+            if cell not in self.reads and cell not in self.writes:
+                self.reads[cell] = value
+        self.writes.update(writes)
+        self.lowest = min(self.lowest, lowest)
+
+    @property
+    def pure(self):
+        """
+        Whether the call didn't look at its return address other than to
+        return. What else it read before writing, in its frame or out of it,
+        is what its result depends on. Cells below the frame that it writes,
+        like the scratch cells of compiled Intcode, are fine, as long as it
+        didn't read them first, and it didn't reach below the frame relative
+        to the base, where what it finds depends on where the frame is.
+        Calls that do I/O aren't recorded to the end.
+        """
+        if self.base in self.reads or self.lowest < self.base:
+            return False
+        writes = self.writes
+        return not any(c < self.base and c in writes for c in self.reads)
+
+    def result(self, steps):
+        """
+        The key and the result a Memo keeps of a pure call that retired
+        `steps` instructions. The key has the cells from the frame up that
+        the call read before writing, relative to the frame, and their
+        values; arguments it didn't read aren't part of it.
+        """
+        base = self.base
+        shape = tuple(sorted(c - base for c in self.reads if c > base))
+        values = tuple(self.reads[base + offset] for offset in shape)
+        writes = tuple((c - base, v) for c, v in self.writes.items() if c >= base)
+        cells = tuple((c, v) for c, v in self.writes.items() if c < base)
+        dependencies = tuple(sorted(c for c in self.reads if c < base))
+        top = max([c for c, v in cells] + list(dependencies), default=-1)
+        key = (self.entry, self.size, shape, values)
+        return key, (steps, writes, cells, dependencies, top)
+
+
+# How many calls of a routine are recorded or looked up before its results
+# have to have saved more instructions than recording it took to keep
+# memoizing it, and about how many instructions looking up a result costs.
+MEMO_TRIAL = 64
+MEMO_LOOKUP = 16
+
+
+class Memo(object):
+    """
+    The results of pure calls, keyed by the routine, its frame size, and the
+    cells from the frame up that the call read, with their values. A result
+    is how many instructions the call retired, the values it left from its
+    frame up, relative to the frame, the values it left below the frame, the
+    cells below the frame that it read, and the highest cell below the frame
+    that it touched. A result is dropped once one of the cells it read is
+    written to, and the least recently used results go once there are more
+    than `size`. Routines that turn out not to be pure, or whose results
+    don't save more than they cost, aren't tried again.
+
+    >>> memo = Memo(size=1)
+    >>> memo.put((10, 3, (1,), (5,)), (4, ((1, 6),), ((63, 1),), (30,), 63))
+    (30,)
+    >>> memory = Memory([0] * 100 + [7, 5, 9])
+    >>> memo.get(10, 3, 100, memory)[0], memo.get(10, 3, 50, memory)
+    ((10, 3, (1,), (5,)), None)
+    >>> memo.invalidate(30)
+    >>> memo.get(10, 3, 100, memory), memo.hits, memo.misses
+    (None, 1, 2)
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.results = OrderedDict()
+        self.shapes = defaultdict(list)
+        # Calls down the same path read the same cells, so the results are
+        # grouped by those cells, and each cell knows its groups. Groups
+        # whose cells didn't hold their initial values are transient.
+        self.groups = {}
+        self.dependents = defaultdict(set)
+        self.transient = set()
+        self.ignored = set()
+        self.calls = defaultdict(int)
+        self.spent = defaultdict(int)
+        self.saved = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, entry, size, base, memory):
+        """
+        The key and result of a call of the routine at `entry` with its
+        frame at `base`, or None. Results that touched cells at `base` or
+        above can't be used there.
+        """
+        for shape in self.shapes.get((entry, size), ()):
+            values = tuple(memory[base + offset] for offset in shape)
+            key = (entry, size, shape, values)
+            result = self.results.get(key)
+            if result is not None and result[4] < base:
+                self.results.move_to_end(key)
+                self.calls[entry] += 1
+                self.saved[entry] += result[0] - MEMO_LOOKUP
+                self.review(entry)
+                self.hits += 1
+                return key, result
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """
+        Keep `result`. Returns the cells it read, if it's the first result
+        that read just those, for the caller to watch; None otherwise.
+        """
+        entry = key[0]
+        self.calls[entry] += 1
+        self.spent[entry] += result[0]
+        self.review(entry)
+
+        self.discard(key)
+        self.results[key] = result
+        shapes = self.shapes[key[:2]]
+        if key[2] not in shapes:
+            shapes.append(key[2])
+
+        dependencies = result[3]
+        group = self.groups.get(dependencies)
+        if group is None:
+            group = self.groups[dependencies] = set()
+            for cell in dependencies:
+                self.dependents[cell].add(dependencies)
+        else:
+            dependencies = None
+        group.add(key)
+
+        if len(self.results) > self.size:
+            self.discard(next(iter(self.results)))
+        return dependencies
+
+    def review(self, entry):
+        if self.calls[entry] >= MEMO_TRIAL and self.saved[entry] < self.spent[entry]:
+            self.ignored.add(entry)
+
+    def discard(self, key):
+        result = self.results.pop(key, None)
+        if result is not None:
+            self.groups.get(result[3], set()).discard(key)
+
+    def drop(self, dependencies):
+        self.transient.discard(dependencies)
+        for key in self.groups.pop(dependencies, ()):
+            self.results.pop(key, None)
+
+    def invalidate(self, cell):
+        for dependencies in self.dependents.pop(cell, ()):
+            self.drop(dependencies)
+
+    def clear(self):
+        self.results.clear()
+        self.groups.clear()
+        self.dependents.clear()
+        self.transient.clear()
+
+    def copy(self):
+        memo = Memo(self.size)
+        memo.results = OrderedDict(self.results)
+        memo.shapes = defaultdict(
+            list, {routine: list(shapes) for routine, shapes in self.shapes.items()}
+        )
+        memo.groups = {cells: set(keys) for cells, keys in self.groups.items()}
+        memo.dependents = defaultdict(
+            set, {cell: set(groups) for cell, groups in self.dependents.items()}
+        )
+        memo.transient = set(self.transient)
+        memo.ignored = set(self.ignored)
+        memo.calls = defaultdict(int, self.calls)
+        memo.spent = defaultdict(int, self.spent)
+        memo.saved = defaultdict(int, self.saved)
+        return memo
+
+
+BLOCK_LIMIT = 64
+PATCH_LIMIT = 2
+
+
+def decode_block(memory, start, volatile=()):
+    """
+    Decode the straight-line instructions from `start` up to and including
+    the first output, jump or halt. The block is cut short after an instruction that
+    writes into the block itself, and before any unknown intcode or input
+    instruction, so that a block which runs out of input can simply be run
+    again once there is some. Writes to
+    `volatile` parameter cells, which are read at run time instead of being
+    baked into the block, don't cut it short. Intcodes are always baked in,
+    so writes to those do, volatile or not.
+
+    >>> decode_block(Memory([1101, 1, 2, 9, 1105, 1, 0, 99]), 0)
+    [(0, 1, (1, 1, 0), (1, 2, 9)), (4, 5, (1, 1, 0), (1, 0))]
+    >>> decode_block(Memory([1101, 1, 2, 6, 1105, 1, 0, 99]), 0)
+    [(0, 1, (1, 1, 0), (1, 2, 6))]
+    >>> len(decode_block(Memory([1101, 1, 2, 6, 1105, 1, 0, 99]), 0, {6}))
+    2
+    >>> len(decode_block(Memory([1101, 1, 2, 4, 1105, 1, 0, 99]), 0, {4}))
+    1
+    >>> decode_block(Memory([104, 1, 3, 0, 99]), 0)
+    [(0, 4, (1, 0, 0), (1,))]
+    """
+    instructions = []
+    pc = start
+    while len(instructions) < BLOCK_LIMIT:
+        intcode = memory[pc]
+        if intcode not in HANDLERS or (intcode % 100 == 3 and pc != start):
+            break
+
+        opcode = intcode % 100
+        count = PARAMETER_COUNTS[opcode]
+        modes = parse_modes(intcode // 100)
+        modes = tuple(int(modes[i]) for i in range(3))
+        params = tuple(memory[pc + 1 + i] for i in range(count))
+        instructions.append((pc, opcode, modes, params))
+        pc += count + 1
+
+        if opcode in (4, 5, 6, 99):
+            break
+
+    if not instructions:
+        raise Exception("Unexpected intcode: %s" % memory[start])
+
+    end = pc
+    starts = {pc for pc, opcode, modes, params in instructions}
+    for i, (pc, opcode, modes, params) in enumerate(instructions):
+        written = INSTRUCTIONS[opcode][2]
+        if written is None or modes[written] != Mode.ABSOLUTE:
+            continue
+        target = params[written]
+        if (
+            pc + 1 + written not in volatile
+            and (target not in volatile or target in starts)
+            and start <= target < end
+        ):
+            return instructions[: i + 1]
+
+    return instructions
+
+
+def compile_block(memory, start, volatile=(), journaled=False):
+    """
+    Translate the block at `start` into a Python function that executes it
+    and returns the next pc. Parameters are baked into the function as
+    constants, except those in `volatile` cells, which are read from memory
+    each time. The function's `cells` attribute lists the baked cells, `end`
+    is one past the last cell of the block, `size` is its number of
+    instructions and `last` the opcode of the last one. A block that returns
+    early adds the instructions it skipped to `computer.skipped`. A
+    `journaled` block records the old value of every cell it writes.
+
+    >>> block = compile_block(Memory([1101, 1, 2, 9, 1105, 1, 0, 99]), 0, {2})
+    >>> block.__name__, block.end, block.cells, block.size, block.last
+    ('block_0', 7, [0, 1, 3, 4, 5, 6], 2, 5)
+    """
+    instructions = decode_block(memory, start, volatile)
+    last, opcode, modes, params = instructions[-1]
+    end = last + len(params) + 1
+    starts = {pc for pc, opcode, modes, params in instructions}
+
+    lines = [
+        "memory = computer.memory",
+        "pages = memory.pages",
+        "base = computer.relative_base",
+    ]
+    cells = []
+    for index, (pc, opcode, modes, params) in enumerate(instructions):
+        name, count, written, body = INSTRUCTIONS[opcode]
+        skipped = len(instructions) - index - 1
+        following = pc + count + 1
+        modes = [Mode(mode) for mode in modes]
+        params = list(params)
+
+        lines.append(f"# {pc}: {name} {tuple(params)}")
+        cells.append(pc)
+        for i in range(count):
+            if pc + 1 + i in volatile:
+                lines += read_source(f"param{i}", pc + 1 + i, Mode.ABSOLUTE, "base")
+                params[i] = f"param{i}"
+            else:
+                cells.append(pc + 1 + i)
+
+        for i in range(count):
+            if i != written:
+                lines += read_source(f"operand{i}", params[i], modes[i], "base")
+
+        if opcode == 99:
+            lines.append(f"computer.pc = {pc}")
+        if opcode == 9:
+            lines += ["base += operand0", "computer.relative_base = base"]
+        else:
+            lines += body.split("\n")
+
+        if written is not None:
+            target, mode = params[written], modes[written]
+            lines += write_source("result", target, mode, "base", journaled)
+            if mode is Mode.IMMEDIATE:
+                pass
+            elif not isinstance(target, int) or mode is Mode.RELATIVE:
+                lines.append(f"if {start} <= address < {end}:")
+                if skipped:
+                    lines.append(f"    computer.skipped += {skipped}")
+                lines.append(f"    return {following}")
+            elif start <= target < end and (target not in volatile or target in starts):
+                if skipped:
+                    lines.append(f"computer.skipped += {skipped}")
+                lines.append(f"return {following}")
+
+    if opcode != 99:
+        lines.append(f"return {end}")
+
+    function = f"block_{start}"
+    source = f"def {function}(computer):\n"
+    source += "".join(f"    {line}\n" for line in lines)
+
+    namespace = dict(BLOCK_GLOBALS)
+    exec(compile(source, f"<intcode {function}>", "exec"), namespace)
+    block = namespace[function]
+    block.source = source
+    block.start = start
+    block.cells = cells
+    block.values = [memory[address] for address in cells]
+    block.end = end
+    block.size = len(instructions)
+    block.last = opcode
+    return block
+
+
+BLOCK_GLOBALS = {"HaltException": HaltException, "__builtins__": builtins}
+
+
 class IntcodeComputer(object):
-    def __init__(self, program, input_queue, output_queue, input_ready):
-        self.memory = defaultdict(lambda: 0, enumerate(program))
+    def __init__(
+        self,
+        program,
+        input_queue=None,
+        output_queue=None,
+        input_ready=None,
+        compiled=False,
+        peephole=False,
+        accelerate=False,
+        memoize=False,
+    ):
+        """
+        Only one engine runs the program, so of the engine options the first
+        of these that is set wins: a trace being recorded, `compiled`,
+        `memoize`, `accelerate` and `peephole`. The last three only apply to
+        runs without `max_steps`, a deadline, `until_output` or a journal,
+        which are interpreted.
+        """
+        self.image = program if isinstance(program, Image) else None
+        if self.image:
+            program = self.image.program
+
+        self.memory = Memory(program)
+        self.memory.watcher = self.forget
+        self.origin = self.memory.fork()
+        self.handlers = HANDLERS
+        self.decoded = {}
+        self.initial_decoded = set()
+        self.compiled = compiled
+        self.peephole = peephole
+        self.fused = {}
+        self.fusions = {}
+        self.defused = defaultdict(int)
+        self.accelerate = accelerate
+        self.loops = {}
+        self.loop_cells = {}
+        self.memo = Memo() if memoize else None
+        self.blocks = {}
+        self.initial_blocks = set()
+        if self.image and compiled:
+            self.blocks.update(self.image.pristine)
+            self.initial_blocks.update(self.image.pristine.values())
+            self.memory.watched.update(self.image.pristine_cells)
+        self.patches = defaultdict(int)
+        self.volatile = set()
         self.pc = 0
         self.relative_base = 0
-        self.input_queue = input_queue
+        self.retired = 0
+        self.trace = None
+        self.input_queue = Channel() if input_queue is None else input_queue
         self.input_ready = input_ready
-        self.output_queue = output_queue
-
-        self.operations = {
-            1: self.op_add,
-            2: self.op_mul,
-            3: self.op_load,
-            4: self.op_print,
-            5: self.op_jump_if_true,
-            6: self.op_jump_if_false,
-            7: self.op_less_than,
-            8: self.op_equals,
-            9: self.op_set_relative_base,
-            99: self.op_halt,
-        }
+        self.output_queue = Channel() if output_queue is None else output_queue
 
     @classmethod
     def read_input(cls, inp):
@@ -67,172 +1411,1708 @@ class IntcodeComputer(object):
         >>> IntcodeComputer.read_input(dedent(inp).strip())
         [1, 9, 10, 3, 2, 3, 11, 0, 99, 30, 40, 50]
         """
-        return [int(i.strip()) for i in inp.split(",")]
+        return [int(i.strip()) for i in inp.split(",")]
+
+    def read_memory(self, val, mode):
+        if mode is Mode.ABSOLUTE:
+            pass
+
+        elif mode is Mode.IMMEDIATE:
+            return val
+
+        elif mode is Mode.RELATIVE:
+            val += self.relative_base
+
+        else:
+            raise Exception(f"Unknown mode: {mode}")
+
+        try:
+            return self.memory.pages[val >> PAGE_BITS][val & PAGE_MASK]
+        except KeyError:
+            return self.memory[val]
+
+    def write_memory(self, loc, mode, val):
+        if mode is Mode.ABSOLUTE:
+            pass
+
+        elif mode is Mode.IMMEDIATE:
+            raise Exception("Can't write to IMMEDIATE mode parameters.")
+
+        elif mode is Mode.RELATIVE:
+            loc += self.relative_base
+
+        else:
+            raise Exception(f"Unknown mode: {mode}")
+
+        try:
+            self.memory.pages[loc >> PAGE_BITS][loc & PAGE_MASK] = val
+        except (KeyError, OverflowError):
+            self.memory[loc] = val
+        else:
+            if loc in self.memory.watched:
+                self.memory.changed(loc)
+
+    def decode(self, pc):
+        """
+        Decode the instruction at `pc` and cache it until one of its cells
+        is written to.
+
+        >>> computer = IntcodeComputer([1002, 4, 3, 4, 33])
+        >>> computer.decode(0) # doctest: +ELLIPSIS
+        (2, <function op_mul_010 ...>, (<Mode.ABSOLUTE: 0>, <Mode.IMMEDIATE: 1>, <Mode.ABSOLUTE: 0>), (4, 3, 4))
+        >>> computer.run()
+        (<Status.HALTED: 0>, 2)
+        >>> sorted(computer.decoded)
+        [0, 4]
+        >>> computer.memory[2] = 2
+        >>> sorted(computer.decoded)
+        [4]
+        """
+        intcode = self.memory[pc]
+        opcode = intcode % 100
+        try:
+            op = self.handlers[intcode]
+        except KeyError:
+            raise Exception("Unexpected intcode: %s" % intcode)
+
+        modes = parse_modes(intcode // 100)
+        count = PARAMETER_COUNTS[opcode]
+        params = tuple(self.memory[pc + 1 + i] for i in range(count))
+        instruction = (opcode, op, (modes[0], modes[1], modes[2]), params)
+
+        self.decoded[pc] = instruction
+        self.memory.watched.update(range(pc, pc + 1 + count))
+        if all(
+            self.origin.peek(pc + i) == value
+            for i, value in enumerate((intcode,) + params)
+        ):
+            self.initial_decoded.add(pc)
+        else:
+            self.initial_decoded.discard(pc)
+
+        return instruction
+
+    def compile(self, pc):
+        """
+        Compile the block at `pc` and cache it until one of the cells baked
+        into it is written to. Parameter cells that keep getting patched by
+        the program are read at run time instead, so that array indexing
+        through self-modification doesn't recompile the block every time.
+
+        >>> computer = IntcodeComputer([1101, 1, 2, 9, 1105, 1, 0, 99])
+        >>> computer.compile(0).end
+        7
+        >>> for _ in range(PATCH_LIMIT):
+        ...     computer.memory[2] = 3
+        ...     block = computer.compile(0)
+        >>> computer.volatile, block.cells
+        ({2}, [0, 1, 3, 4, 5, 6])
+        """
+        journaled = self.memory.journal is not None
+        block = self.image and not journaled and self.image.lookup(self.memory, pc)
+        if not block:
+            block = compile_block(self.memory, pc, self.volatile, journaled)
+            if self.image and not journaled:
+                self.image.add(block)
+
+        self.blocks[pc] = block
+        self.memory.watched.update(block.cells)
+        if all(self.origin.peek(a) == v for a, v in zip(block.cells, block.values)):
+            self.initial_blocks.add(block)
+
+        return block
+
+    def fuse(self, pc):
+        """
+        Decode the instructions at `pc` into a superinstruction if they
+        start with one, or into the one instruction at `pc` otherwise, as
+        (instructions, handler, params, cells). It's cached until one of its
+        cells is written to. Instructions whose superinstructions keep getting
+        written to are left alone.
+
+        >>> program = [1001,20,1,20,1007,20,9,21,1005,21,0,99]
+        >>> computer = IntcodeComputer(program, peephole=True)
+        >>> size, handler, params, cells = computer.fuse(0)
+        >>> size, handler.__name__, params, cells
+        (3, 'op_count_compare_jump_1001_1007_1005', (20, 1, 20, 20, 9, 21, 21, 0), 11)
+        >>> computer.run(), computer.memory[20]
+        ((<Status.HALTED: 0>, 28), 9)
+        >>> computer.memory[5] = 21
+        >>> sorted(computer.fused)
+        [11]
+        """
+        if self.defused.get(pc, 0) >= PATCH_LIMIT:
+            opcode, op, modes, params = self.decoded.get(pc) or self.decode(pc)
+            entry = self.fused[pc] = (1, op, params, len(params) + 1)
+            return entry
+
+        instructions = []
+        address = pc
+        while len(instructions) < 3:
+            try:
+                instruction = self.decoded.get(address) or self.decode(address)
+            except Exception:
+                if not instructions:
+                    raise
+                break
+
+            instructions.append(instruction)
+            if instruction[0] not in (1, 2, 7, 8, 9):
+                break
+            address += len(instruction[3]) + 1
+
+        match = match_superinstruction(instructions)
+        if match is None:
+            opcode, op, modes, params = instructions[0]
+            entry = (1, op, params, len(params) + 1)
+        else:
+            name, size, forwards = match
+            instructions = instructions[:size]
+            intcodes = tuple(
+                opcode + 100 * modes[0] + 1000 * modes[1] + 10000 * modes[2]
+                for opcode, op, modes, params in instructions
+            )
+            params = tuple(p for instruction in instructions for p in instruction[3])
+            handler = superinstruction(name, intcodes, forwards)
+            entry = (size, handler, params, size + len(params))
+            for cell in range(pc, pc + entry[3]):
+                self.fusions.setdefault(cell, []).append(pc)
+
+        self.fused[pc] = entry
+        return entry
+
+    def forget(self, address):
+        for pc in range(address - 3, address + 1):
+            instruction = self.decoded.get(pc)
+            if instruction and pc + len(instruction[3]) >= address:
+                del self.decoded[pc]
+                if self.fused.pop(pc, None):
+                    self.defused[pc] += 1
+
+        for pc in self.fusions.pop(address, ()):
+            if self.fused.pop(pc, None):
+                self.defused[pc] += 1
+
+        for pc in self.loop_cells.pop(address, ()):
+            self.loops.pop(pc, None)
+
+        if self.memo is not None:
+            self.memo.invalidate(address)
+
+        stale = [
+            pc
+            for pc, block in self.blocks.items()
+            if pc <= address < block.end and address in block.cells
+        ]
+        for pc in stale:
+            del self.blocks[pc]
+            if pc != address:
+                self.patches[address] += 1
+                if self.patches[address] >= PATCH_LIMIT:
+                    self.volatile.add(address)
+
+    def fork(self):
+        """
+        A new computer in the same state as this one, that carries on
+        independently from here. Memory is shared page by page until either
+        side touches it, and decoded instructions and compiled blocks carry
+        over. The new computer gets its own empty queues.
+
+        >>> computer = IntcodeComputer([3,0,4,0,3,0,4,0,99])
+        >>> machine = computer.execute([5])
+        >>> next(machine), next(machine)
+        (5, None)
+        >>> list(computer.fork().execute([6])), list(computer.fork().execute([7]))
+        ([6], [7])
+        >>> machine.send(8), computer.memory[0]
+        (8, 8)
+        """
+        computer = IntcodeComputer.__new__(IntcodeComputer)
+        computer.__dict__.update(self.__dict__)
+        computer.memory = self.memory.fork()
+        computer.memory.watcher = computer.forget
+        computer.decoded = dict(self.decoded)
+        computer.initial_decoded = set(self.initial_decoded)
+        computer.fused = dict(self.fused)
+        computer.fusions = {cell: list(pcs) for cell, pcs in self.fusions.items()}
+        computer.defused = defaultdict(int, self.defused)
+        computer.loops = dict(self.loops)
+        computer.loop_cells = {cell: list(pcs) for cell, pcs in self.loop_cells.items()}
+        if self.memo is not None:
+            computer.memo = self.memo.copy()
+        computer.blocks = dict(self.blocks)
+        computer.patches = defaultdict(int, self.patches)
+        computer.volatile = set(self.volatile)
+        computer.input_queue = Channel()
+        computer.input_ready = None
+        computer.output_queue = Channel()
+        computer.trace = None
+        return computer
+
+    def snapshot(self):
+        """
+        Save the state of the computer, to restore() it or fork() from it
+        later. Like a fork, it only costs memory for the pages that are
+        written to afterwards.
+        """
+        return self.fork()
+
+    def restore(self, snapshot):
+        """
+        Put the computer back into the state of `snapshot`, which can be
+        restored again. The queues are left alone.
+
+        >>> computer = IntcodeComputer([1001,0,1,0,4,0,99])
+        >>> saved = computer.snapshot()
+        >>> for _ in range(2):
+        ...     computer.restore(saved)
+        ...     list(computer.execute())
+        [1002]
+        [1002]
+        """
+        state = snapshot.fork()
+        self.memory = state.memory
+        self.memory.watcher = self.forget
+        self.handlers = state.handlers
+        self.decoded = state.decoded
+        self.initial_decoded = state.initial_decoded
+        self.fused = state.fused
+        self.fusions = state.fusions
+        self.loops = state.loops
+        self.loop_cells = state.loop_cells
+        if self.memo is not None:
+            self.memo.clear()
+        self.blocks = state.blocks
+        self.pc = state.pc
+        self.relative_base = state.relative_base
+
+    def reset(self):
+        """
+        Put the computer back into its initial state, to run the program
+        again. The page table is rebuilt from the initial memory, which
+        shares its pages until they're written to, so this doesn't copy any
+        cells. Decoded instructions and blocks that match the initial memory
+        are kept.
+
+        >>> computer = IntcodeComputer([1101,7,0,5,104,0,99], compiled=True)
+        >>> list(computer.execute()), sorted(computer.blocks)
+        ([7], [0, 4, 6])
+        >>> computer.reset()
+        >>> sorted(computer.blocks), computer.memory[5]
+        ([0, 6], 0)
+        >>> list(computer.execute())
+        [7]
+
+        Cells patched often enough on one run stay volatile on the next, but
+        an intcode is still never baked into a block after it's been patched:
+
+        >>> program = [4,7,207,0,5,8,1105,1,2,99,0,0,0,3,0,0]
+        >>> computer = IntcodeComputer(program, compiled=True)
+        >>> for _ in range(3):
+        ...     computer.reset()
+        ...     list(computer.execute()), computer.memory[1]
+        ([1], 7)
+        ([1], 7)
+        ([1], 7)
+
+        Pages that a fork moved out of the computer's own page table are
+        put back too:
+
+        >>> computer = IntcodeComputer([1101,7,0,9,104,0,99,0,0,0])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 3)
+        >>> child = computer.fork()
+        >>> computer.reset(), child.reset()
+        (None, None)
+        >>> computer.dump_memory()[9], child.dump_memory()[9]
+        (0, 0)
+        """
+        memory = self.memory
+        if self.memo is not None:
+            # Restoring pages doesn't tell the watcher, so drop the results
+            # that read cells the program had changed.
+            for dependencies in list(self.memo.transient):
+                self.memo.drop(dependencies)
+
+        memory.shared = dict(self.origin.shared)
+        memory.pages.clear()
+
+        # Anything cached that the program has written to since has already
+        # been forgotten, so what's left is still valid if it was decoded or
+        # compiled from the initial memory.
+        for pc in [pc for pc in self.decoded if pc not in self.initial_decoded]:
+            del self.decoded[pc]
+        for pc, block in list(self.blocks.items()):
+            if block not in self.initial_blocks:
+                del self.blocks[pc]
+        self.fused.clear()
+        self.fusions.clear()
+        self.loops.clear()
+        self.loop_cells.clear()
+
+        if memory.journal is not None:
+            memory.journal = []
+        self.pc = 0
+        self.relative_base = 0
+
+    def mark(self):
+        """
+        Return a checkpoint to rollback() to. The first mark turns on the
+        journal of overwritten cells, and switches to handlers and blocks
+        that keep it; until then writes aren't journaled at all.
+
+        >>> computer = IntcodeComputer([3,0,1001,0,1,0,4,0,99])
+        >>> machine = computer.execute()
+        >>> next(machine)
+        >>> checkpoint = computer.mark()
+        >>> machine.send(5), computer.memory.journal
+        (6, [(0, 3), (0, 5)])
+        >>> computer.rollback(checkpoint)
+        >>> machine = computer.execute([9])
+        >>> next(machine), computer.memory.journal
+        (10, [(0, 3), (0, 9)])
+        """
+        if self.memory.journal is None:
+            self.memory.journal = []
+            self.handlers = journaled_handlers()
+            self.decoded.clear()
+            self.fused.clear()
+            self.fusions.clear()
+            self.loops.clear()
+            self.loop_cells.clear()
+            if self.memo is not None:
+                self.memo.clear()
+            self.blocks.clear()
+
+        return (len(self.memory.journal), self.pc, self.relative_base)
+
+    def rollback(self, mark):
+        """
+        Undo every write since `mark` was taken, in reverse, and go back to
+        its pc and relative base. Input already read and output already
+        written aren't taken back.
+        """
+        size, self.pc, self.relative_base = mark
+
+        journal, self.memory.journal = self.memory.journal, None
+        try:
+            while len(journal) > size:
+                address, value = journal.pop()
+                self.memory[address] = value
+        finally:
+            self.memory.journal = journal
+
+    def dump_memory(self):
+        """
+        The memory from address 0 up to the end of the loaded program, or
+        past it up to the highest cell that holds a non-zero value. Unlike
+        the memory of the dict-based computers the days started out with,
+        which ran up to the highest cell ever read or written, cells past
+        the program that only ever held zeros aren't included.
+
+        >>> computer = IntcodeComputer([1101,0,0,20,1001,30,7,9,99,0])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 3)
+        >>> computer.dump_memory()
+        [1101, 0, 0, 20, 1001, 30, 7, 9, 99, 7]
+        """
+        return self.memory.dump()
+
+    def flush_output(self):
+        if isinstance(self.output_queue, (Buffer, Channel)):
+            return self.output_queue.drain()
+
+        result = []
+        while not self.output_queue.empty():
+            result.append(self.output_queue.get())
+
+        return result
+
+    def next_input(self):
+        val = None
+        while val is None:
+            if self.input_ready is not None:
+                with self.input_ready:
+                    self.input_ready.notify_all()
+            val = int(self.input_queue.get())
+
+        return val
+
+    def run(self, max_steps=None, deadline=None, until_output=False):
+        """
+        Run the program until it halts, wants input that a non-blocking input
+        such as a Buffer doesn't have, or has written an output if
+        `until_output` is set. It also stops once it has retired `max_steps`
+        instructions or is past `deadline`, a time.monotonic() value that is
+        checked every so often. Returns the Status and the number of
+        instructions retired.
+
+        >>> computer = IntcodeComputer([1, 0, 0, 2, 99])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 2)
+        >>> computer.dump_memory()
+        [1, 0, 2, 2, 99]
+        >>> computer = IntcodeComputer([1,9,10,3,2,3,11,0,99,30,40,50])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 3)
+        >>> computer.dump_memory()
+        [3500, 9, 10, 70, 2, 3, 11, 0, 99, 30, 40, 50]
+        >>> computer = IntcodeComputer([1,0,0,0,99])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 2)
+        >>> computer.dump_memory()
+        [2, 0, 0, 0, 99]
+        >>> computer = IntcodeComputer([2,3,0,3,99])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 2)
+        >>> computer.dump_memory()
+        [2, 3, 0, 6, 99]
+        >>> computer = IntcodeComputer([2,4,4,5,99,0])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 2)
+        >>> computer.dump_memory()
+        [2, 4, 4, 5, 99, 9801]
+        >>> computer = IntcodeComputer([1,1,1,4,99,5,6,0,99])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 3)
+        >>> computer.dump_memory()
+        [30, 1, 1, 4, 2, 5, 6, 0, 99]
+
+        >>> computer = IntcodeComputer([109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 81)
+        >>> computer.flush_output()
+        [109, 1, 204, -1, 1001, 100, 1, 100, 1008, 100, 16, 101, 1006, 101, 0, 99]
+        >>> computer = IntcodeComputer([1102,34915192,34915192,7,4,7,99,0])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 3)
+        >>> computer.flush_output()
+        [1219070632396864]
+        >>> computer = IntcodeComputer([104,1125899906842624,99])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 2)
+        >>> computer.flush_output()
+        [1125899906842624]
+
+        >>> computer = IntcodeComputer([104,7,1005,17,16,1101,0,8,1,1101,0,1,17,1105,1,0,99,0])
+        >>> computer.run()
+        (<Status.HALTED: 0>, 8)
+        >>> computer.flush_output()
+        [7, 8]
+        """
+        if self.trace is not None:
+            status, steps = self.run_traced(max_steps, deadline, until_output)
+        elif self.compiled:
+            status, steps = self.run_compiled(max_steps, deadline, until_output)
+        elif (
+            (self.peephole or self.accelerate or self.memo is not None)
+            and max_steps is None
+            and deadline is None
+            and not until_output
+            and self.memory.journal is None
+        ):
+            if self.memo is not None:
+                status, steps = self.run_memoized()
+            elif self.accelerate:
+                status, steps = self.run_accelerated()
+            else:
+                status, steps = self.run_peephole()
+        else:
+            status, steps = self.run_interpreted(max_steps, deadline, until_output)
+
+        self.retired += steps
+        return status, steps
+
+    def run_interpreted(self, max_steps=None, deadline=None, until_output=False):
+        """
+        >>> computer = IntcodeComputer([1001,7,1,7,1105,1,0,0])
+        >>> computer.run(max_steps=5), computer.memory[7]
+        ((<Status.BUDGET_EXHAUSTED: 3>, 5), 3)
+        >>> computer.run(deadline=time.monotonic())
+        (<Status.BUDGET_EXHAUSTED: 3>, 0)
+        >>> computer = IntcodeComputer([104,1,104,2,99])
+        >>> computer.run(until_output=True), computer.run(), computer.flush_output()
+        ((<Status.OUTPUT_READY: 2>, 1), (<Status.HALTED: 0>, 2), [1, 2])
+        """
+        decoded = self.decoded
+        steps = 0
+        try:
+            if max_steps is None and deadline is None and not until_output:
+                while True:
+                    try:
+                        opcode, op, modes, params = decoded[self.pc]
+                    except KeyError:
+                        opcode, op, modes, params = self.decode(self.pc)
+
+                    self.pc = op(self, params)
+                    steps += 1
+
+            while max_steps is None or steps < max_steps:
+                if (
+                    deadline is not None
+                    and not steps & DEADLINE_INTERVAL
+                    and time.monotonic() >= deadline
+                ):
+                    break
+
+                try:
+                    opcode, op, modes, params = decoded[self.pc]
+                except KeyError:
+                    opcode, op, modes, params = self.decode(self.pc)
+
+                self.pc = op(self, params)
+                steps += 1
+                if until_output and opcode == 4:
+                    return Status.OUTPUT_READY, steps
+
+            return Status.BUDGET_EXHAUSTED, steps
+
+        except HaltException:
+            return Status.HALTED, steps + 1
+
+        except InputRequired:
+            return Status.NEEDS_INPUT, steps
+
+    def run_peephole(self):
+        """
+        Like an unbounded run_interpreted(), with superinstructions for the
+        sequences that compiled Intcode is full of. Budgets, deadlines and
+        until_output are left to run_interpreted().
+
+        >>> program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+        >>> computer = IntcodeComputer(program, peephole=True)
+        >>> computer.run(), computer.flush_output() == program
+        ((<Status.HALTED: 0>, 81), True)
+        >>> program = [1106,99,0,1107,0,9,9,1005,9,11,99,104,5,99]
+        >>> computer = IntcodeComputer(program, peephole=True)
+        >>> computer.run(), computer.memory[9], computer.flush_output()
+        ((<Status.HALTED: 0>, 4), 1, [])
+        """
+        fused = self.fused
+        self.skipped = steps = 0
+        try:
+            while True:
+                try:
+                    size, op, params, cells = fused[self.pc]
+                except KeyError:
+                    size, op, params, cells = self.fuse(self.pc)
+
+                self.pc = op(self, params)
+                steps += size
+
+        except HaltException:
+            return Status.HALTED, steps + 1 - self.skipped
+
+        except InputRequired:
+            return Status.NEEDS_INPUT, steps - self.skipped
+
+    def find_loop(self, start, jump):
+        """
+        The Loop that the jump at `jump` closes by going back to `start`, or
+        None. A Loop is cached until one of its cells is written to, and
+        None for good.
+        """
+        loop = self.loops[jump] = Loop.find(self, start, jump)
+        if loop is not None:
+            for cell in range(start, jump + 3):
+                self.loop_cells.setdefault(cell, []).append(jump)
+        return loop
+
+    def run_accelerated(self):
+        """
+        Like an unbounded run_interpreted(), except that a loop that has
+        just jumped back to its start is run to its end in one go if it's
+        a Loop that can be. A loop that can't be is left to run, and isn't
+        tried again.
+        """
+        decoded = self.decoded
+        loops = self.loops
+        steps = 0
+        try:
+            while True:
+                pc = self.pc
+                try:
+                    opcode, op, modes, params = decoded[pc]
+                except KeyError:
+                    opcode, op, modes, params = self.decode(pc)
+
+                self.pc = op(self, params)
+                steps += 1
+
+                if self.pc <= pc and (opcode == 5 or opcode == 6):
+                    try:
+                        loop = loops[pc]
+                    except KeyError:
+                        loop = self.find_loop(self.pc, pc)
+                    if loop is None or loop.start != self.pc:
+                        continue
+
+                    iterations = loop.accelerate(self)
+                    if iterations is None:
+                        loops[pc] = None
+                    else:
+                        steps += iterations * loop.size
+                        self.pc = pc + 3
+
+        except HaltException:
+            return Status.HALTED, steps + 1
+
+        except InputRequired:
+            return Status.NEEDS_INPUT, steps
+
+    def run_memoized(self):
+        """
+        Like an unbounded run_interpreted(), except that calls of pure
+        routines are looked up in self.memo by their arguments, and run and
+        recorded there if they aren't in it yet. A call is the same as for
+        profiler.CallGraph: a jump to a routine that starts by moving the
+        relative base up past the caller's frame, which holds the return
+        address and the arguments. It returns by moving the base back down
+        and jumping to that address. A call that's looked up leaves memory
+        and the count of instructions retired just as running it would.
+
+        >>> program = [109,100,21101,7,0,1,21101,13,0,0,1105,1,40,21101,7,0,1,
+        ...     21101,24,0,0,1105,1,40,204,2,99] + [0] * 13
+        >>> program += [109,2,22102,6,-1,0,109,-2,2106,0,0]
+        >>> computer = IntcodeComputer(program, memoize=True)
+        >>> computer.run(), computer.flush_output()
+        ((<Status.HALTED: 0>, 17), [42])
+        >>> computer.memo.hits, computer.memo.misses, list(computer.memo.results)
+        (1, 1, [(40, 2, (1,), (7,))])
+
+        A routine that counts its calls in a global cell is never looked up,
+        since what it reads there is what it changes:
+
+        >>> program = [109,100,21101,9,0,0,1105,1,30,21101,16,0,0,1105,1,30,
+        ...     4,60,99] + [0] * 11 + [109,1,1001,60,1,60,109,-1,2106,0,0]
+        >>> computer = IntcodeComputer(program + [0] * 20, memoize=True)
+        >>> computer.run(), computer.flush_output(), computer.memo.hits
+        ((<Status.HALTED: 0>, 15), [2], 0)
+        """
+        decoded = self.decoded
+        memory = self.memory
+        memo = self.memo
+        calls = []
+        steps = 0
+        try:
+            while True:
+                pc = self.pc
+                try:
+                    opcode, op, modes, params = decoded[pc]
+                except KeyError:
+                    opcode, op, modes, params = self.decode(pc)
 
-    def read_memory(self, val, mode):
-        if mode is Mode.ABSOLUTE:
-            return self.memory[val]
+                if calls:
+                    if opcode == 3 or opcode == 4:
+                        # None of the calls under way can be memoized now.
+                        memo.ignored.update(call.entry for call in calls)
+                        calls.clear()
+                    else:
+                        written = self.follow_call(calls[-1], opcode, modes, params)
 
-        elif mode is Mode.IMMEDIATE:
-            return val
+                self.pc = op(self, params)
+                steps += 1
 
-        elif mode is Mode.RELATIVE:
-            return self.memory[self.relative_base + val]
+                if calls and written is not None:
+                    cell = params[written]
+                    if modes[written]:
+                        cell += self.relative_base
+                    calls[-1].writes[cell] = memory[cell]
 
-        else:
-            raise Exception(f"Unknown mode: {mode}")
+                if (opcode == 5 or opcode == 6) and self.pc != pc + 3:
+                    if (
+                        calls
+                        and self.pc == calls[-1].returns
+                        and self.relative_base == calls[-1].base
+                    ):
+                        self.return_call(calls, steps)
 
-    def write_memory(self, loc, mode, val):
-        if mode is Mode.ABSOLUTE:
-            self.memory[loc] = val
+                    try:
+                        opcode, op, modes, params = decoded[self.pc]
+                    except KeyError:
+                        opcode, op, modes, params = self.decode(self.pc)
+                    if (
+                        opcode == 9
+                        and modes[0] == Mode.IMMEDIATE
+                        and params[0] > 0
+                        and self.pc not in memo.ignored
+                    ):
+                        steps += self.enter_call(calls, params[0], steps)
 
-        elif mode is Mode.IMMEDIATE:
-            raise Exception("Can't write to IMMEDIATE mode parameters.")
+        except HaltException:
+            return Status.HALTED, steps + 1
 
-        elif mode is Mode.RELATIVE:
-            self.memory[loc + self.relative_base] = val
+        except InputRequired:
+            return Status.NEEDS_INPUT, steps
 
-        else:
-            raise Exception(f"Unknown mode: {mode}")
+    def follow_call(self, call, opcode, modes, params):
+        """
+        Note the cells that the instruction about to run reads in `call`,
+        and return the index of the parameter it writes, if any.
+        """
+        reads, writes = call.reads, call.writes
+        cells = list(range(self.pc, self.pc + len(params) + 1))
+        written = INSTRUCTIONS[opcode][2]
+        for i, param in enumerate(params):
+            if modes[i] == Mode.RELATIVE:
+                call.lowest = min(call.lowest, param + self.relative_base)
+            if i == written or modes[i] == Mode.IMMEDIATE:
+                continue
+            cell = param + self.relative_base if modes[i] else param
+            # Returning reads the return address, which isn't something the
+            # result depends on.
+            if cell != call.base or i != 1 or opcode not in (5, 6):
+                cells.append(cell)
 
-    def dump_memory(self):
-        max_location = max(self.memory.keys())
-        return [self.memory[loc] for loc in range(max_location + 1)]
+        for cell in cells:
+            if cell not in reads and cell not in writes:
+                reads[cell] = self.memory[cell]
+        return written
 
-    def flush_output(self):
-        result = []
-        while not self.output_queue.empty():
-            result.append(self.output_queue.get())
+    def enter_call(self, calls, size, steps):
+        """
+        Enter the routine at the pc, with a frame of `size` cells. If the
+        call's result is in the memo, return from it right away with the
+        number of instructions it retired. Otherwise start recording it on
+        `calls` and return 0.
+        """
+        memory = self.memory
+        base = self.relative_base
+        found = self.memo.get(self.pc, size, base, memory)
+        if found is None:
+            calls.append(Call(self.pc, base, size, steps, memory[base]))
+            return 0
 
-        return result
+        (_, _, shape, _), (taken, writes, cells, dependencies, top) = found
+        writes = {base + offset: value for offset, value in writes}
+        writes.update(cells)
+        for cell, value in writes.items():
+            memory[cell] = value
+        self.pc = memory[base]
 
-    def op_add(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        result = operand1 + operand2
-        self.write_memory(self.memory[self.pc + 3], modes[2], result)
-        return self.pc + 4
-
-    def op_mul(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        result = operand1 * operand2
-        self.write_memory(self.memory[self.pc + 3], modes[2], result)
-        return self.pc + 4
-
-    def op_load(self, modes):
-        # print('1234'*100)
-        val = None
-        while val is None:
-            with self.input_ready:
-                # print('7890'*2)
-                self.input_ready.notify_all()
-                # print('jljklk'*2)
-            val = int(self.input_queue.get())
-            # print(f'read: {val}')
-            # print(f'ooo{val}ooo')
-
-        self.write_memory(self.memory[self.pc + 1], modes[0], val)
-        return self.pc + 2
-
-    def op_print(self, modes):
-        val = self.read_memory(self.memory[self.pc + 1], modes[0])
-        self.output_queue.put(val)
-        return self.pc + 2
-
-    def op_jump_if_true(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        if operand1 > 0:
-            return operand2
-        else:
-            return self.pc + 3
+        if calls:
+            reads = [base + offset for offset in shape] + list(dependencies)
+            calls[-1].merge({cell: memory[cell] for cell in reads}, writes, base)
+        return taken
 
-    def op_jump_if_false(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        if operand1 == 0:
-            return operand2
+    def return_call(self, calls, steps):
+        """
+        Put the result of the call on top of `calls`, which has just
+        returned, into the memo.
+        """
+        call = calls.pop()
+        if not call.pure:
+            self.memo.ignored.add(call.entry)
         else:
-            return self.pc + 3
-
-    def op_less_than(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        loc = self.memory[self.pc + 3]
-        result = 1 if operand1 < operand2 else 0
-        self.write_memory(self.memory[self.pc + 3], modes[2], result)
-        return self.pc + 4
-
-    def op_equals(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        operand2 = self.read_memory(self.memory[self.pc + 2], modes[1])
-        loc = self.memory[self.pc + 3]
-        result = 1 if operand1 == operand2 else 0
-        self.write_memory(self.memory[self.pc + 3], modes[2], result)
-        return self.pc + 4
-
-    def op_set_relative_base(self, modes):
-        operand1 = self.read_memory(self.memory[self.pc + 1], modes[0])
-        self.relative_base += operand1
-        return self.pc + 2
-
-    def op_halt(self, modes):
-        raise HaltException()
+            key, result = call.result(steps - call.start)
+            cells = self.memo.put(key, result)
+            if cells:
+                self.memory.watched.update(cells)
+                if any(self.memory[c] != self.origin.peek(c) for c in cells):
+                    self.memo.transient.add(cells)
 
-    def run(self):
+        if calls:
+            calls[-1].merge(call.reads, call.writes, call.lowest)
+
+    def run_compiled(self, max_steps=None, deadline=None, until_output=False):
         """
-        >>> computer = IntcodeComputer([1, 0, 0, 2, 99])
-        >>> computer.run()
-        >>> computer.dump_memory()
-        [1, 0, 2, 2, 99]
-        >>> computer = IntcodeComputer([1,9,10,3,2,3,11,0,99,30,40,50])
-        >>> computer.run()
-        >>> computer.dump_memory()
-        [3500, 9, 10, 70, 2, 3, 11, 0, 99, 30, 40, 50]
-        >>> computer = IntcodeComputer([1,0,0,0,99])
-        >>> computer.run()
-        >>> computer.dump_memory()
-        [2, 0, 0, 0, 99]
-        >>> computer = IntcodeComputer([2,3,0,3,99])
-        >>> computer.run()
-        >>> computer.dump_memory()
-        [2, 3, 0, 6, 99]
-        >>> computer = IntcodeComputer([2,4,4,5,99,0])
-        >>> computer.run()
-        >>> computer.dump_memory()
-        [2, 4, 4, 5, 99, 9801]
-        >>> computer = IntcodeComputer([1,1,1,4,99,5,6,0,99])
-        >>> computer.run()
-        >>> computer.dump_memory()
-        [30, 1, 1, 4, 2, 5, 6, 0, 99]
+        Like run_interpreted(), but with the block compiler. Budgets are
+        still exact: the last few instructions that don't make a whole block
+        are interpreted.
 
-        >>> computer = IntcodeComputer([109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99])
+        >>> program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+        >>> computer = IntcodeComputer(program, compiled=True)
         >>> computer.run()
-        >>> computer.flush_output()
-        [109, 1, 204, -1, 1001, 100, 1, 100, 1008, 100, 16, 101, 1006, 101, 0, 99]
-        >>> computer = IntcodeComputer([1102,34915192,34915192,7,4,7,99,0])
+        (<Status.HALTED: 0>, 81)
+        >>> computer.flush_output() == program
+        True
+        >>> computer = IntcodeComputer([1,1,1,4,99,5,6,0,99], compiled=True)
         >>> computer.run()
-        >>> computer.flush_output()
-        [1219070632396864]
-        >>> computer = IntcodeComputer([104,1125899906842624,99])
+        (<Status.HALTED: 0>, 3)
+        >>> computer.dump_memory(), computer.pc
+        ([30, 1, 1, 4, 2, 5, 6, 0, 99], 8)
+        >>> computer = IntcodeComputer([104,7,1005,17,16,1101,0,8,1,1101,0,1,17,1105,1,0,99,0], compiled=True)
         >>> computer.run()
+        (<Status.HALTED: 0>, 8)
         >>> computer.flush_output()
-        [1125899906842624]
+        [7, 8]
+        >>> computer = IntcodeComputer(program, compiled=True)
+        >>> computer.run(max_steps=10), computer.run(until_output=True)
+        ((<Status.BUDGET_EXHAUSTED: 3>, 10), (<Status.OUTPUT_READY: 2>, 2))
+        >>> computer.run(), computer.flush_output() == program
+        ((<Status.HALTED: 0>, 69), True)
+        >>> computer = IntcodeComputer([21101,0,5,5,104,7,99], compiled=True)
+        >>> computer.run(until_output=True), computer.flush_output()
+        ((<Status.OUTPUT_READY: 2>, 2), [5])
+        """
+        blocks = self.blocks
+        bounded = max_steps is not None or deadline is not None or until_output
+        self.skipped = steps = 0
+        try:
+            while True:
+                try:
+                    block = blocks[self.pc]
+                except KeyError:
+                    block = self.compile(self.pc)
+
+                if bounded:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        return Status.BUDGET_EXHAUSTED, steps - self.skipped
+                    if max_steps is not None and steps + block.size > max_steps:
+                        # Not enough budget left for the whole block.
+                        steps -= self.skipped
+                        status, tail = self.run_interpreted(
+                            max_steps - steps, deadline, until_output
+                        )
+                        return status, steps + tail
+
+                self.pc = block(self)
+                steps += block.size
+                # A block that wrote into itself returns before its output.
+                if until_output and block.last == 4 and self.pc == block.end:
+                    return Status.OUTPUT_READY, steps - self.skipped
+
+        except HaltException:
+            return Status.HALTED, steps + block.size - self.skipped
+
+        except InputRequired:
+            return Status.NEEDS_INPUT, steps - self.skipped
+
+    def record(self, sample=0):
+        """
+        Record a Trace of the program from here on, sampling the pc every
+        `sample` instructions if that's given. Recorded runs are always
+        interpreted.
+
+        >>> computer = IntcodeComputer([3,9,8,9,10,9,4,9,99,-1,8])
+        >>> trace = computer.record(sample=2)
+        >>> list(computer.execute([8]))
+        [1]
+        >>> trace.inputs, trace.outputs, trace.stamps, trace.pcs
+        (array('q', [8]), array('q', [1]), array('q', [3]), array('q', [0, 6]))
+        """
+        self.trace = Trace(
+            self.dump_memory(), sample, self.retired, self.pc, self.relative_base
+        )
+        return self.trace
+
+    def run_traced(self, max_steps=None, deadline=None, until_output=False):
+        """
+        Like run_interpreted(), recording the inputs read, the outputs
+        written with the count of instructions retired when they were, and
+        sampled pcs into self.trace.
+        """
+        trace = self.trace
+        decoded = self.decoded
+        retired = self.retired
+        steps = 0
+        try:
+            while max_steps is None or steps < max_steps:
+                if (
+                    deadline is not None
+                    and not steps & DEADLINE_INTERVAL
+                    and time.monotonic() >= deadline
+                ):
+                    break
+
+                pc = self.pc
+                try:
+                    opcode, op, modes, params = decoded[pc]
+                except KeyError:
+                    opcode, op, modes, params = self.decode(pc)
+
+                if trace.sample and not (retired + steps) % trace.sample:
+                    trace.pcs.append(pc)
+
+                self.pc = op(self, params)
+                steps += 1
+                if opcode == 3:
+                    trace.inputs.append(self.read_memory(params[0], modes[0]))
+                elif opcode == 4:
+                    trace.outputs.append(self.read_memory(params[0], modes[0]))
+                    trace.stamps.append(retired + steps)
+                    if until_output:
+                        return Status.OUTPUT_READY, steps
+
+            return Status.BUDGET_EXHAUSTED, steps
+
+        except HaltException:
+            return Status.HALTED, steps + 1
+
+        except InputRequired:
+            return Status.NEEDS_INPUT, steps
+
+    def execute(self, inputs=()):
+        """
+        Run the program in the calling thread, as a generator of its output
+        values. When the program wants input that hasn't been given yet, the
+        generator yields None and waits for the value to be sent in. Values
+        sent in at any other point are queued up as input as well. Replaces
+        the computer's queues with Buffers.
+
+        >>> computer = IntcodeComputer([3,9,8,9,10,9,4,9,99,-1,8])
+        >>> list(computer.execute([8]))
+        [1]
+        >>> machine = IntcodeComputer([3,0,4,0,3,0,4,0,99]).execute()
+        >>> next(machine) is None
+        True
+        >>> machine.send(5), next(machine), machine.send(6)
+        (5, None, 6)
+        >>> machine = IntcodeComputer([3,0,4,0,3,0,4,0,99], compiled=True).execute()
+        >>> next(machine), machine.send(5), machine.send(6)
+        (None, 5, 6)
+        >>> list(machine)
+        []
         """
+        self.input_queue = Buffer(inputs)
+        self.output_queue = outputs = Buffer()
+
         while True:
-            intcode = self.memory[self.pc]
-            # print(f'xxxx{intcode}')
+            status, _ = self.run()
 
-            try:
-                opcode = intcode % 100
-                modes = parse_modes(intcode // 100)
-                op = self.operations[opcode]
-                self.pc = op(modes)
+            while outputs:
+                value = yield outputs.popleft()
+                if value is not None:
+                    self.input_queue.append(value)
+
+            if status is Status.HALTED:
+                return
+
+            while not self.input_queue:
+                value = yield None
+                if value is not None:
+                    self.input_queue.append(value)
+
+
+class ComputerPool(object):
+    """
+    Warm computers for running one program many times over. A released
+    computer is reset and handed out again by the next acquire(), with its
+    decoded instructions and compiled blocks intact, and with `memoize` the
+    results of the calls it memoized. Like for IntcodeComputer, `memoize`
+    only applies if the pool isn't `compiled`.
+
+    >>> pool = ComputerPool([3,9,1002,9,2,9,4,9,99,0])
+    >>> [pool.run([i]) for i in range(3)]
+    [[0], [2], [4]]
+    >>> len(pool.idle)
+    1
+    """
+
+    def __init__(self, program, compiled=True, memoize=False):
+        self.program = program
+        self.compiled = compiled
+        self.memoize = memoize
+        self.idle = []
+
+    def acquire(self):
+        if self.idle:
+            return self.idle.pop()
+        return IntcodeComputer(
+            self.program, compiled=self.compiled, memoize=self.memoize
+        )
+
+    def release(self, computer):
+        computer.reset()
+        self.idle.append(computer)
+
+    def run(self, inputs=()):
+        """
+        Return the outputs of the program on `inputs`. Raises InputRequired
+        if it wants more input than that.
+        """
+        computer = self.acquire()
+        computer.input_queue, computer.output_queue = Buffer(inputs), Buffer()
+        try:
+            status, _ = computer.run()
+            if status is not Status.HALTED:
+                raise InputRequired()
+            return computer.output_queue.drain()
+        finally:
+            self.release(computer)
+
+
+class Deadlock(Exception):
+    pass
+
+
+class Network(object):
+    """
+    A network of computers that runs in the calling thread. Every machine
+    reads from its own input Buffer and writes to its own output Buffer;
+    connect() makes one machine's output the other's input, and send() puts
+    values into a machine's input. run() gives the machines turns round-robin,
+    each turn lasting until the machine halts or needs input nobody has sent
+    yet, so the interleaving is always the same.
+
+    >>> program = [3,0,4,0,3,0,99]
+    >>> network = Network()
+    >>> first, second = network.add(program), network.add(program)
+    >>> network.connect(first, second).connect(second, first).send(first, 7).run()
+    Traceback (most recent call last):
+    ...
+    intcode.Deadlock: Machines waiting for input: 1
+    >>> program = [3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,4,27,
+    ...            1001,28,-1,28,1005,28,6,99,0,0,5]
+    >>> network = Network()
+    >>> amplifiers = [network.add(program) for phase in range(5)]
+    >>> for amplifier, phase in zip(amplifiers, [9, 8, 7, 6, 5]):
+    ...     network = network.connect(amplifier, (amplifier + 1) % 5)
+    ...     network = network.send(amplifier, phase)
+    >>> network.send(0, 0).run(max_steps=4)
+    [<Status.HALTED: 0>, <Status.HALTED: 0>, <Status.HALTED: 0>, <Status.HALTED: 0>, <Status.HALTED: 0>]
+    >>> network.machines[0].input_queue
+    Buffer([139629729])
+    """
+
+    def __init__(self):
+        self.machines = []
+        self.status = []
+
+    def add(self, program, compiled=False):
+        """
+        Add a machine running `program` and return its number. The program
+        can also be a computer that has already started, which then gets new
+        Buffers.
+        """
+        if isinstance(program, IntcodeComputer):
+            computer = program
+            computer.input_queue, computer.output_queue = Buffer(), Buffer()
+        else:
+            computer = IntcodeComputer(program, Buffer(), Buffer(), compiled=compiled)
+
+        self.machines.append(computer)
+        self.status.append(None)
+        return len(self.machines) - 1
+
+    def connect(self, source, target):
+        """
+        Send the outputs of machine `source` to machine `target`. Anything
+        already waiting for `target` is kept.
+        """
+        channel = self.machines[source].output_queue
+        channel.extend(self.machines[target].input_queue)
+        self.machines[target].input_queue = channel
+        return self
+
+    def send(self, machine, *values):
+        self.machines[machine].input_queue.extend(values)
+        return self
+
+    def run(self, max_steps=None):
+        """
+        Run every machine until all of them have halted, and return their
+        statuses. A turn ends early after `max_steps` instructions. Raises
+        Deadlock if every machine that hasn't halted waits for input that
+        can't come.
+        """
+        machines, status = self.machines, self.status
+        while True:
+            progress = False
+            for i, computer in enumerate(machines):
+                if status[i] is Status.HALTED or (
+                    status[i] is Status.NEEDS_INPUT and not computer.input_queue
+                ):
+                    continue
+
+                status[i], steps = computer.run(max_steps)
+                progress = progress or steps
+
+            if all(s is Status.HALTED for s in status):
+                return status
+            if not progress:
+                waiting = (i for i, s in enumerate(status) if s is Status.NEEDS_INPUT)
+                raise Deadlock(
+                    "Machines waiting for input: %s" % ", ".join(map(str, waiting))
+                )
 
-            except HaltException:
-                # print("halting")
+
+class Telemetry(object):
+    """
+    Where the time of a computer goes: running instructions, waiting for
+    input, or, when it is driven through execute(), in the code that
+    consumes its outputs. The counts of its queues are included if they are
+    MeteredChannels. With an `interval`, the stats are written to `stream`
+    every `interval` seconds while the computer runs.
+
+    >>> computer = IntcodeComputer([3,9,8,9,10,9,4,9,99,-1,8])
+    >>> telemetry = Telemetry(computer)
+    >>> list(telemetry.execute([8]))
+    [1]
+    >>> stats = telemetry.stats()
+    >>> stats["retired"], stats["inputs"], stats["outputs"]
+    (4, 1, 1)
+    >>> computer = IntcodeComputer(
+    ...     [3,9,8,9,10,9,4,9,99,-1,8], MeteredChannel([7]), MeteredChannel()
+    ... )
+    >>> Telemetry(computer).run(), computer.flush_output()
+    (<Status.HALTED: 0>, [0])
+    >>> sorted(Telemetry(computer).stats())
+    ... # doctest: +NORMALIZE_WHITESPACE
+    ['input high water', 'input waits', 'inputs', 'output high water',
+     'outputs', 'retired', 'seconds', 'seconds in peripheral',
+     'seconds waiting for input']
+    """
+
+    def __init__(self, computer, interval=None, stream=None):
+        self.computer = computer
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.seconds = 0.0
+        self.peripheral = 0.0
+        self.inputs = 0
+        self.outputs = 0
+        self.dumped = time.perf_counter()
+
+    def stats(self):
+        stats = {
+            "retired": self.computer.retired,
+            "seconds": self.seconds,
+            "seconds in peripheral": self.peripheral,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+        }
+
+        inputs, outputs = self.computer.input_queue, self.computer.output_queue
+        if isinstance(inputs, MeteredChannel):
+            stats["inputs"] = inputs.received
+            stats["input high water"] = inputs.high_water
+            stats["input waits"] = inputs.waits
+            stats["seconds waiting for input"] = inputs.blocked
+        if isinstance(outputs, MeteredChannel):
+            stats["outputs"] = outputs.sent
+            stats["output high water"] = outputs.high_water
+
+        return stats
+
+    def dump(self):
+        self.dumped = time.perf_counter()
+        print(
+            ", ".join(
+                f"{name} {value:.3f}" if isinstance(value, float) else f"{name} {value}"
+                for name, value in self.stats().items()
+            ),
+            file=self.stream,
+        )
+
+    def tick(self):
+        if self.interval and time.perf_counter() - self.dumped >= self.interval:
+            self.dump()
+
+    def run(self):
+        """
+        Run the computer until it halts or, with a non-blocking input, runs
+        out of input, dumping the stats on the way.
+        """
+        while True:
+            start = time.perf_counter()
+            deadline = time.monotonic() + self.interval if self.interval else None
+            status, _ = self.computer.run(deadline=deadline)
+            self.seconds += time.perf_counter() - start
+            self.tick()
+            if status is not Status.BUDGET_EXHAUSTED:
+                return status
+
+    def execute(self, inputs=()):
+        """
+        The computer's execute() generator, timing the computer and whatever
+        the caller does between values separately.
+        """
+        machine = self.computer.execute(inputs)
+        self.inputs += len(inputs)
+        value = None
+        while True:
+            start = time.perf_counter()
+            try:
+                output = machine.send(value)
+            except StopIteration:
+                self.seconds += time.perf_counter() - start
                 return
+            returned = time.perf_counter()
+            self.seconds += returned - start
+            self.outputs += output is not None
+            self.tick()
+
+            value = yield output
+            self.inputs += value is not None
+            self.peripheral += time.perf_counter() - returned
+
+
+class Trace(object):
+    """
+    What a run of a program read and wrote, in 64 bit arrays: the inputs it
+    read, its outputs, the number of instructions it had retired when it
+    wrote each output, and the pc every `sample` instructions. It keeps the
+    memory, pc and relative base the recording started from, so it can be
+    replayed without the code that produced the inputs.
+
+    A saved trace is a header of counts followed by the arrays, and load()
+    maps it into memoryviews instead of reading it.
+
+    >>> import tempfile
+    >>> computer = IntcodeComputer([3,9,8,9,10,9,4,9,99,-1,8])
+    >>> trace = computer.record()
+    >>> list(computer.execute([8]))
+    [1]
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     path = os.path.join(directory, "8.trace")
+    ...     trace.save(path)
+    ...     loaded = Trace.load(path)
+    ...     replayed = loaded.replay()
+    ...     replayed.run(), loaded.check(replayed.flush_output())
+    ...     list(loaded.stamps)
+    ((<Status.HALTED: 0>, 4), True)
+    [3]
+
+    A recording can start in the middle of a run:
+
+    >>> computer = IntcodeComputer([3,20,3,21,4,21,99], Buffer([1]), Buffer())
+    >>> computer.run()
+    (<Status.NEEDS_INPUT: 1>, 1)
+    >>> trace = computer.record()
+    >>> computer.input_queue.put(2)
+    >>> computer.run(), computer.flush_output()
+    ((<Status.HALTED: 0>, 3), [2])
+    >>> replayed = trace.replay()
+    >>> replayed.run(), trace.check(replayed.flush_output())
+    ((<Status.HALTED: 0>, 3), True)
+    """
+
+    def __init__(self, program=(), sample=0, retired=0, pc=0, relative_base=0):
+        self.program = array("q", program)
+        self.sample = sample
+        self.retired = retired
+        self.pc = pc
+        self.relative_base = relative_base
+        self.inputs = array("q")
+        self.outputs = array("q")
+        self.stamps = array("q")
+        self.pcs = array("q")
+
+    def save(self, path):
+        header = array(
+            "q",
+            [
+                self.sample,
+                self.retired,
+                self.pc,
+                self.relative_base,
+                len(self.program),
+                len(self.inputs),
+                len(self.outputs),
+                len(self.pcs),
+            ],
+        )
+        with open(path, "wb") as f:
+            for values in (
+                header,
+                self.program,
+                self.inputs,
+                self.outputs,
+                self.stamps,
+                self.pcs,
+            ):
+                f.write(values.tobytes() if isinstance(values, array) else values)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            words = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        words = words.cast("q")
+
+        trace = cls.__new__(cls)
+        trace.sample, trace.retired, trace.pc, trace.relative_base = words[:4]
+        start = 8
+        for name, count in zip(
+            ("program", "inputs", "outputs", "pcs"), words[4:8].tolist()
+        ):
+            setattr(trace, name, words[start : start + count])
+            start += count
+            if name == "outputs":
+                trace.stamps = words[start : start + count]
+                start += count
+
+        return trace
+
+    def replay(self, compiled=False):
+        """
+        A computer at the start of the recording, with the recorded inputs
+        queued up.
+        """
+        computer = IntcodeComputer(
+            list(self.program), Buffer(self.inputs), Buffer(), compiled=compiled
+        )
+        computer.pc, computer.relative_base = self.pc, self.relative_base
+        return computer
+
+    def check(self, outputs):
+        return list(outputs) == list(self.outputs)
+
+
+with open(__file__, "rb") as f:
+    ENGINE_VERSION = "%s-%s" % (
+        hashlib.sha256(f.read()).hexdigest()[:16],
+        sys.implementation.cache_tag,
+    )
+
+IMAGE_VARIANTS = 4
+
+
+class Image(object):
+    """
+    A parsed program together with the blocks compiled from it. Any
+    IntcodeComputer built from the image reuses a block as long as the cells
+    it was compiled from still hold the same values.
+
+    >>> image = Image("", [1101, 1, 2, 9, 1106, 1, 0, 99])
+    >>> computer = IntcodeComputer(image, compiled=True)
+    >>> block = computer.compile(0)
+    >>> IntcodeComputer(image, compiled=True).compile(0) is block
+    True
+    >>> computer.memory[1] = 5
+    >>> computer.compile(0) is block
+    False
+    >>> len(image.blocks[0])
+    2
+    """
+
+    def __init__(self, digest, program, blocks=None):
+        self.digest = digest
+        self.program = program
+        self.blocks = {}
+        self.pristine = {}
+        self.pristine_cells = set()
+        self.dirty = False
+
+        for variants in (blocks or {}).values():
+            for block in reversed(variants):
+                self.add(block)
+        self.dirty = False
+
+    def initial(self, address):
+        return self.program[address] if address < len(self.program) else 0
+
+    def lookup(self, memory, pc):
+        for block in self.blocks.get(pc, ()):
+            if all(memory[a] == v for a, v in zip(block.cells, block.values)):
+                return block
+
+    def add(self, block):
+        """
+        Remember `block`. Blocks compiled from the program as loaded are also
+        handed to every new compiled computer up front, so they need neither
+        compiling nor checking.
+        """
+        variants = self.blocks.setdefault(block.start, [])
+        variants.insert(0, block)
+        del variants[IMAGE_VARIANTS:]
+        self.dirty = True
+
+        if all(self.initial(a) == v for a, v in zip(block.cells, block.values)):
+            self.pristine[block.start] = block
+            self.pristine_cells.update(block.cells)
+
+    def dumps(self):
+        blocks = {
+            pc: [
+                (b.__code__, b.source, b.cells, b.values, b.end, b.size, b.last)
+                for b in variants
+            ]
+            for pc, variants in self.blocks.items()
+        }
+        return marshal.dumps((ENGINE_VERSION, self.program, blocks))
+
+    @classmethod
+    def loads(cls, digest, data):
+        """
+        >>> image = Image("", [1101, 1, 2, 9, 1106, 1, 0, 99])
+        >>> IntcodeComputer(image, compiled=True).run()
+        (<Status.HALTED: 0>, 3)
+        >>> copy = Image.loads("", image.dumps())
+        >>> computer = IntcodeComputer(copy, compiled=True)
+        >>> computer.run()
+        (<Status.HALTED: 0>, 3)
+        >>> computer.memory[9], sorted(copy.blocks)
+        (3, [0, 7])
+        """
+        version, program, entries = marshal.loads(data)
+        if version != ENGINE_VERSION:
+            raise ValueError(f"Image built by engine {version}")
 
-            except KeyError:
-                raise Exception("Unexpected intcode: %s" % intcode)
+        blocks = {}
+        for pc, variants in entries.items():
+            for code, source, cells, values, end, size, last in variants:
+                block = types.FunctionType(code, BLOCK_GLOBALS)
+                block.source = source
+                block.start = pc
+                block.cells = cells
+                block.values = values
+                block.end = end
+                block.size = size
+                block.last = last
+                blocks.setdefault(pc, []).append(block)
+
+        return cls(digest, program, blocks)
+
+
+class ImageCache(object):
+    """
+    Images on disk, one file per program, named after the SHA-256 of the
+    program's comma-separated source. Files written by another version of
+    this module are ignored, and the least recently used ones are removed
+    once the directory grows past `limit` bytes.
+
+    >>> import tempfile
+    >>> cache = ImageCache(tempfile.mkdtemp(), limit=10 ** 6)
+    >>> image = cache.load("1101,1,2,9,1106,1,0,99")
+    >>> IntcodeComputer(image, compiled=True).run()
+    (<Status.HALTED: 0>, 3)
+    >>> cache.save()
+    >>> ImageCache(cache.directory).load("1101,1,2,9,1106,1,0,99").blocks.keys()
+    dict_keys([0, 7])
+    """
+
+    def __init__(self, directory=None, limit=64 * 2**20):
+        self.directory = directory or os.environ.get(
+            "INTCODE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "intcode")
+        )
+        self.limit = limit
+        self.images = {}
+
+    def path(self, digest):
+        return os.path.join(self.directory, f"{digest}.image")
+
+    def load(self, source):
+        """
+        Return the image for `source`, either a comma-separated program or an
+        already parsed (and possibly patched) list of ints.
+        """
+        if not isinstance(source, str):
+            source = ",".join(str(i) for i in source)
+        source = source.strip()
+        digest = hashlib.sha256(source.encode()).hexdigest()
+
+        if digest not in self.images:
+            self.images[digest] = self.read(digest) or Image(
+                digest, IntcodeComputer.read_input(source)
+            )
+
+        return self.images[digest]
+
+    def read(self, digest):
+        try:
+            with open(self.path(digest), "rb") as f:
+                image = Image.loads(digest, f.read())
+
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+        os.utime(self.path(digest))
+        return image
+
+    def save(self):
+        """
+        Write the images that changed. A directory that can't be written
+        leaves them to be compiled again next time.
+        """
+        dirty = [digest for digest, image in self.images.items() if image.dirty]
+        if not dirty:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for digest in dirty:
+                temporary = f"{self.path(digest)}.{os.getpid()}"
+                with open(temporary, "wb") as f:
+                    f.write(self.images[digest].dumps())
+                os.replace(temporary, self.path(digest))
+                self.images[digest].dirty = False
+
+            evict(self.directory, ".image", self.limit)
+        except OSError:
+            pass
+
+
+def evict(directory, suffix, limit):
+    """
+    Remove the least recently used files ending in `suffix` from `directory`
+    until the rest take up at most `limit` bytes.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(suffix):
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= limit:
+            break
+        os.remove(os.path.join(directory, name))
+        total -= size
+
+
+IMAGES = ImageCache()
+atexit.register(IMAGES.save)
+
+
+def load_image(source):
+    """
+    Load `source` through the default on-disk image cache, which is written
+    back when the interpreter exits.
+    """
+    return IMAGES.load(source)
+
+
+class ResultCache(object):
+    """
+    The outputs of complete runs, keyed by the digest of the program's image
+    and the inputs. The `size` most recently used results are kept in memory.
+    With a `directory`, results are kept on disk as well, one file per
+    program, written back by save() and evicted least recently used first
+    once they take up more than `limit` bytes. A run that wants more input
+    than it was given depends on what it is told later, so it isn't cached
+    and raises InputRequired.
+
+    >>> results = ResultCache(size=2)
+    >>> image = Image("equals 8", [3,9,8,9,10,9,4,9,99,-1,8])
+    >>> results.run(image, [8]), results.run(image, [8]), results.run(image, [7])
+    ([1], [1], [0])
+    >>> results.hits, results.misses
+    (1, 2)
+    >>> results.run(image)
+    Traceback (most recent call last):
+    ...
+    intcode.InputRequired
+    >>> import tempfile
+    >>> stored = ResultCache(directory=tempfile.mkdtemp())
+    >>> stored.run_many(image, [[8], [9]], lambda image, jobs: [[2], [3]])
+    [[2], [3]]
+    >>> stored.save()
+    >>> ResultCache(directory=stored.directory).run(image, [9])
+    [3]
+    """
+
+    def __init__(self, size=2**16, directory=None, limit=16 * 2**20):
+        self.size = size
+        self.directory = directory or None
+        self.limit = limit
+        self.recent = OrderedDict()
+        self.stored = {}
+        self.dirty = set()
+        self.pools = {}
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, digest):
+        return os.path.join(self.directory, f"{digest}.results")
+
+    def stored_results(self, digest):
+        """
+        The results of the program with `digest` on disk, read on first use.
+        """
+        try:
+            return self.stored[digest]
+        except KeyError:
+            pass
+
+        self.stored[digest] = {}
+        try:
+            with open(self.path(digest), "rb") as f:
+                version, results = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return self.stored[digest]
+
+        if version == ENGINE_VERSION:
+            os.utime(self.path(digest))
+            self.stored[digest] = results
+        return self.stored[digest]
+
+    def get(self, digest, inputs):
+        key = (digest, inputs)
+        try:
+            self.recent.move_to_end(key)
+            return self.recent[key]
+        except KeyError:
+            pass
+
+        if self.directory is None:
+            return None
+        outputs = self.stored_results(digest).get(inputs)
+        if outputs is not None:
+            self.remember(key, outputs)
+        return outputs
+
+    def remember(self, key, outputs):
+        self.recent[key] = outputs
+        if len(self.recent) > self.size:
+            self.recent.popitem(last=False)
+
+    def put(self, digest, inputs, outputs):
+        outputs = tuple(outputs)
+        self.remember((digest, inputs), outputs)
+        if self.directory is not None:
+            self.stored_results(digest)[inputs] = outputs
+            self.dirty.add(digest)
+
+    def run(self, program, inputs=()):
+        return self.run_many(program, [inputs])[0]
+
+    def run_many(self, program, jobs, runner=None):
+        """
+        The outputs of `program` for every list of inputs in `jobs`. The
+        runs that aren't cached are handed to `runner(image, jobs)` in one
+        go, which returns their outputs in the same order; by default they
+        run one by one on warm computers.
+        """
+        image = program if isinstance(program, Image) else load_image(program)
+        jobs = [tuple(inputs) for inputs in jobs]
+        results = [self.get(image.digest, inputs) for inputs in jobs]
+        missing = [inputs for inputs, outputs in zip(jobs, results) if outputs is None]
+        self.hits += len(jobs) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            computed = iter((runner or self.compute)(image, missing))
+            for i, outputs in enumerate(results):
+                if outputs is None:
+                    results[i] = next(computed)
+                    self.put(image.digest, jobs[i], results[i])
+
+        return [list(outputs) for outputs in results]
+
+    def compute(self, image, jobs):
+        try:
+            pool = self.pools[image.digest]
+        except KeyError:
+            pool = self.pools[image.digest] = ComputerPool(image)
+        return [pool.run(inputs) for inputs in jobs]
+
+    def save(self):
+        if self.directory is None or not self.dirty:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for digest in self.dirty:
+                temporary = f"{self.path(digest)}.{os.getpid()}"
+                with open(temporary, "wb") as f:
+                    f.write(marshal.dumps((ENGINE_VERSION, self.stored[digest])))
+                os.replace(temporary, self.path(digest))
+
+            self.dirty.clear()
+            evict(self.directory, ".results", self.limit)
+        except OSError:
+            pass
+
+
+RESULTS = ResultCache(directory=os.environ.get("INTCODE_RESULTS"))
+atexit.register(RESULTS.save)
+
+
+def run_cached(program, inputs=()):
+    """
+    Run `program` on `inputs` through the default result cache. It only
+    keeps results on disk if INTCODE_RESULTS names a directory for them.
+    """
+    return RESULTS.run(program, inputs)
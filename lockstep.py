@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from intcode import INSTRUCTIONS, PARAMETER_COUNTS, Image, Mode, parse_modes
+
+
+class LockstepComputer(object):
+    """
+    Runs one Intcode program on many lanes at once, each with its own inputs.
+    The lanes' memories are the rows of one NumPy matrix. Every step takes
+    the lanes at the lowest pc whose instruction reads the same, and
+    executes that instruction for all of them with vector operations. Lanes
+    split up when they branch differently or modify their code differently,
+    and join up again once they're back at the same pc. Cells are 64 bits
+    wide and, unlike in IntcodeComputer, silently wrap around.
+
+    >>> program = [3,9,8,9,10,9,4,9,99,-1,8]
+    >>> LockstepComputer(program, [[7], [8], [9]]).run()
+    [[0], [1], [0]]
+    >>> program = [3,12,6,12,15,1,13,14,13,4,13,99,-1,0,1,9]
+    >>> LockstepComputer(program, [[0], [5]]).run()
+    [[0], [1]]
+    >>> program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+    >>> LockstepComputer(program, [[]] * 2).run()[1] == program
+    True
+    """
+
+    def __init__(self, program, inputs):
+        if isinstance(program, Image):
+            program = program.program
+
+        lanes = len(inputs)
+        self.memory = np.zeros((lanes, max(len(program), 1)), dtype=np.int64)
+        self.memory[:, : len(program)] = program
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.relative_base = np.zeros(lanes, dtype=np.int64)
+        self.halted = np.zeros(lanes, dtype=bool)
+        self.waiting = np.zeros(lanes, dtype=bool)
+
+        width = max((len(i) for i in inputs), default=0)
+        self.inputs = np.zeros((lanes, width), dtype=np.int64)
+        self.input_counts = np.zeros(lanes, dtype=np.int64)
+        self.inputs_left = np.array([len(i) for i in inputs], dtype=np.int64)
+        for lane, values in enumerate(inputs):
+            self.inputs[lane, : len(values)] = values
+
+        self.outputs = [[] for _ in range(lanes)]
+        self.modes = {}
+
+    def reserve(self, size):
+        columns = self.memory.shape[1]
+        if size > columns:
+            grown = np.zeros((len(self.memory), max(size, 2 * columns)), np.int64)
+            grown[:, :columns] = self.memory
+            self.memory = grown
+
+    def address(self, lanes, param, mode):
+        if mode is Mode.ABSOLUTE:
+            lowest = highest = address = param
+        else:
+            address = self.relative_base[lanes] + param
+            lowest, highest = int(address.min()), int(address.max())
+
+        if lowest < 0:
+            raise IndexError(f"Negative memory address: {lowest}")
+        self.reserve(highest + 1)
+        return address
+
+    def read(self, lanes, param, mode):
+        if mode is Mode.IMMEDIATE:
+            return param
+        address = self.address(lanes, param, mode)
+        return self.memory[lanes, address]
+
+    def write(self, lanes, param, mode, values):
+        if mode is Mode.IMMEDIATE:
+            raise Exception("Can't write to IMMEDIATE mode parameters.")
+        address = self.address(lanes, param, mode)
+        self.memory[lanes, address] = values
+
+    def run(self):
+        """
+        Run every lane until it halts or wants more input than it was
+        given, and return the outputs of each lane.
+        """
+        while True:
+            lanes = np.flatnonzero(~(self.halted | self.waiting))
+            if not len(lanes):
+                return self.outputs
+
+            pcs = self.pc[lanes]
+            pc = int(pcs.min())
+            self.step(lanes[pcs == pc], pc)
+
+    def step(self, lanes, pc):
+        self.reserve(pc + 4)
+        intcode = int(self.memory[lanes[0], pc])
+        opcode = intcode % 100
+        if opcode not in INSTRUCTIONS:
+            raise Exception("Unexpected intcode: %s" % intcode)
+
+        count = PARAMETER_COUNTS[opcode]
+        words = self.memory[lanes, pc : pc + count + 1]
+        same = (words == words[0]).all(axis=1)
+        if not same.all():
+            lanes, words = lanes[same], words[same]
+
+        try:
+            modes = self.modes[intcode]
+        except KeyError:
+            modes = self.modes[intcode] = parse_modes(intcode // 100)
+        params = [int(param) for param in words[0, 1:]]
+        operands = [
+            self.read(lanes, params[i], modes[i])
+            for i in range(count)
+            if i != INSTRUCTIONS[opcode][2]
+        ]
+        following = pc + count + 1
+
+        if opcode == 1:
+            self.write(lanes, params[2], modes[2], operands[0] + operands[1])
+        elif opcode == 2:
+            self.write(lanes, params[2], modes[2], operands[0] * operands[1])
+        elif opcode == 3:
+            starved = self.inputs_left[lanes] == 0
+            self.waiting[lanes[starved]] = True
+            lanes = lanes[~starved]
+            if not len(lanes):
+                return
+            values = self.inputs[lanes, self.input_counts[lanes]]
+            self.input_counts[lanes] += 1
+            self.inputs_left[lanes] -= 1
+            self.write(lanes, params[0], modes[0], values)
+        elif opcode == 4:
+            values = np.broadcast_to(operands[0], lanes.shape)
+            for lane, value in zip(lanes.tolist(), values.tolist()):
+                self.outputs[lane].append(value)
+        elif opcode == 5:
+            self.pc[lanes] = np.where(operands[0] > 0, operands[1], following)
+            return
+        elif opcode == 6:
+            self.pc[lanes] = np.where(operands[0] == 0, operands[1], following)
+            return
+        elif opcode == 7:
+            self.write(lanes, params[2], modes[2], operands[0] < operands[1])
+        elif opcode == 8:
+            self.write(lanes, params[2], modes[2], operands[0] == operands[1])
+        elif opcode == 9:
+            self.relative_base[lanes] += operands[0]
+        elif opcode == 99:
+            self.halted[lanes] = True
+            return
+
+        self.pc[lanes] = following
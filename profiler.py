@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+"""
+Where an Intcode program spends its instructions: counts per opcode, per
+address and per mode combination, branches taken and not taken, and the
+hottest stretches of code, or the instructions of each routine in its call
+tree:
+
+    python profiler.py 9/input --inputs 2
+    python profiler.py 13/input --json
+    python profiler.py 19/input --inputs 10,12 --calls
+    python profiler.py 13/input --collapsed > 13.folded
+    python profiler.py 9/input --inputs 2 --listing
+"""
+
+import argparse
+import json
+import sys
+from collections import Counter, defaultdict
+
+from analysis import ControlFlowGraph
+from intcode import (
+    INSTRUCTIONS,
+    PARAMETER_COUNTS,
+    Buffer,
+    HaltException,
+    InputRequired,
+    IntcodeComputer,
+    Status,
+)
+
+
+def intcode_of(opcode, modes):
+    """
+    >>> from intcode import Mode
+    >>> intcode_of(2, (Mode.ABSOLUTE, Mode.IMMEDIATE, Mode.ABSOLUTE))
+    1002
+    """
+    return opcode + sum(mode * 10 ** (i + 2) for i, mode in enumerate(modes))
+
+
+class Profile(object):
+    """
+    Runs a computer in a loop of its own that counts every instruction it
+    retires by address, opcode and modes, so IntcodeComputer.run() doesn't
+    pay for any of it.
+
+    >>> computer = IntcodeComputer([1101,3,0,12,1001,12,-1,12,1005,12,4,99,0])
+    >>> profile = Profile()
+    >>> profile.run(computer), computer.retired
+    ((<Status.HALTED: 0>, 8), 8)
+    >>> profile.opcodes()
+    Counter({'add': 4, 'jump_if_true': 3, 'halt': 1})
+    >>> profile.branches[8]
+    [1, 2]
+    >>> profile.hottest()
+    [(4, 11, 6), (0, 4, 1), (11, 12, 1)]
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.branches = defaultdict(lambda: [0, 0])
+
+    def run(self, computer, max_steps=None):
+        """
+        Like IntcodeComputer.run(), without compiled blocks or a deadline.
+        The instructions it retires count towards `computer.retired` too.
+        """
+        counts, branches = self.counts, self.branches
+        decoded = computer.decoded
+        steps = 0
+        try:
+            while max_steps is None or steps < max_steps:
+                pc = computer.pc
+                try:
+                    opcode, op, modes, params = decoded[pc]
+                except KeyError:
+                    opcode, op, modes, params = computer.decode(pc)
+
+                computer.pc = op(computer, params)
+                steps += 1
+                counts[pc, opcode, modes] += 1
+                if opcode == 5 or opcode == 6:
+                    branches[pc][computer.pc != pc + 3] += 1
+
+            status = Status.BUDGET_EXHAUSTED
+
+        except HaltException:
+            counts[pc, opcode, modes] += 1
+            status, steps = Status.HALTED, steps + 1
+
+        except InputRequired:
+            status = Status.NEEDS_INPUT
+
+        computer.retired += steps
+        return status, steps
+
+    @property
+    def retired(self):
+        return sum(self.counts.values())
+
+    def opcodes(self):
+        result = Counter()
+        for (pc, opcode, modes), count in self.counts.items():
+            result[INSTRUCTIONS[opcode][0]] += count
+        return result
+
+    def intcodes(self):
+        result = Counter()
+        for (pc, opcode, modes), count in self.counts.items():
+            result[intcode_of(opcode, modes)] += count
+        return result
+
+    def addresses(self):
+        result = Counter()
+        for (pc, opcode, modes), count in self.counts.items():
+            result[pc] += count
+        return result
+
+    def hottest(self, limit=10):
+        """
+        The `limit` stretches of code that retired the most instructions, as
+        (start, end, instructions). A stretch is a run of adjacent
+        instructions that all ran the same number of times.
+        """
+        lengths = {}
+        for pc, opcode, modes in self.counts:
+            lengths[pc] = max(lengths.get(pc, 0), PARAMETER_COUNTS[opcode] + 1)
+
+        addresses = self.addresses()
+        ranges = []
+        for pc in sorted(addresses):
+            start, end, retired = ranges[-1] if ranges else (None, None, 0)
+            if pc == end and addresses[pc] == addresses[start]:
+                ranges[-1] = (start, pc + lengths[pc], retired + addresses[pc])
+            else:
+                ranges.append((pc, pc + lengths[pc], addresses[pc]))
+
+        return sorted(ranges, key=lambda r: -r[2])[:limit]
+
+    def table(self, limit=10):
+        retired = self.retired or 1
+        lines = [f"{'addresses':<24}{'instructions':>14}{'share':>8}"]
+        for start, end, count in self.hottest(limit):
+            lines.append(
+                f"{f'{start}-{end - 1}':<24}{count:>14}{count / retired:>8.1%}"
+            )
+
+        lines.append("")
+        lines.append(f"{'intcode':<24}{'instructions':>14}{'share':>8}")
+        for intcode, count in self.intcodes().most_common(limit):
+            name = INSTRUCTIONS[intcode % 100][0]
+            lines.append(f"{f'{intcode} {name}':<24}{count:>14}{count / retired:>8.1%}")
+
+        lines.append("")
+        lines.append(f"{'branch':<24}{'taken':>14}{'not taken':>12}")
+        for pc, (not_taken, taken) in sorted(self.branches.items()):
+            lines.append(f"{pc:<24}{taken:>14}{not_taken:>12}")
+
+        return "\n".join(lines)
+
+    def json(self, limit=10):
+        return json.dumps(
+            {
+                "retired": self.retired,
+                "opcodes": self.opcodes(),
+                "intcodes": {str(k): v for k, v in self.intcodes().items()},
+                "addresses": {str(k): v for k, v in sorted(self.addresses().items())},
+                "branches": {
+                    str(pc): {"taken": taken, "not_taken": not_taken}
+                    for pc, (not_taken, taken) in sorted(self.branches.items())
+                },
+                "hottest": [
+                    {"start": start, "end": end, "retired": count}
+                    for start, end, count in self.hottest(limit)
+                ],
+            },
+            indent=2,
+        )
+
+
+class Routine(object):
+    """
+    A node of the call tree: the routine starting at `entry`, as called
+    along one path from the top.
+    """
+
+    def __init__(self, entry, base=0):
+        self.entry = entry
+        self.base = base
+        self.calls = 0
+        self.exclusive = 0
+        self.children = {}
+
+    @property
+    def name(self):
+        return "main" if self.entry is None else f"sub_{self.entry}"
+
+    @property
+    def inclusive(self):
+        return self.exclusive + sum(c.inclusive for c in self.children.values())
+
+    def call(self, entry, base):
+        try:
+            routine = self.children[entry]
+        except KeyError:
+            routine = self.children[entry] = Routine(entry)
+        routine.base = base
+        routine.calls += 1
+        return routine
+
+    def collapsed(self, path=()):
+        """
+        Lines of `path;to;routine instructions`, the folded stacks that
+        flame graph tools read.
+        """
+        path += (self.name,)
+        if self.exclusive:
+            yield f"{';'.join(path)} {self.exclusive}"
+        for child in self.children.values():
+            yield from child.collapsed(path)
+
+
+class CallGraph(object):
+    """
+    Rebuilds the calls of a program from the way compiled Intcode manages
+    its stack: a call jumps to a routine that starts by moving the relative
+    base up past the caller's frame, and a routine returns after moving it
+    back down. Instructions are counted against the routine on top of the
+    stack, in a run loop of its own like Profile's.
+
+    >>> program = [109,100,21101,9,0,0,1105,1,10,99,109,5,1101,1,1,30,109,-5,2105,1,0]
+    >>> graph = CallGraph()
+    >>> computer = IntcodeComputer(program)
+    >>> graph.run(computer), computer.retired
+    ((<Status.HALTED: 0>, 8), 8)
+    >>> print("\\n".join(graph.root.collapsed()))
+    main 5
+    main;sub_10 3
+    >>> graph.routines()
+    {None: [1, 8, 5], 10: [1, 3, 3]}
+    """
+
+    def __init__(self):
+        self.root = Routine(None)
+        self.root.calls = 1
+        self.stack = [self.root]
+
+    def run(self, computer, max_steps=None):
+        stack = self.stack
+        decoded = computer.decoded
+        jumped = False
+        steps = 0
+        try:
+            while max_steps is None or steps < max_steps:
+                pc = computer.pc
+                try:
+                    opcode, op, modes, params = decoded[pc]
+                except KeyError:
+                    opcode, op, modes, params = computer.decode(pc)
+
+                base = computer.relative_base
+                computer.pc = op(computer, params)
+                steps += 1
+
+                if opcode == 9:
+                    if jumped and computer.relative_base > base:
+                        stack.append(stack[-1].call(pc, base))
+                    stack[-1].exclusive += 1
+                    while len(stack) > 1 and computer.relative_base <= stack[-1].base:
+                        stack.pop()
+                else:
+                    stack[-1].exclusive += 1
+
+                jumped = (opcode == 5 or opcode == 6) and computer.pc != pc + 3
+
+            status = Status.BUDGET_EXHAUSTED
+
+        except HaltException:
+            stack[-1].exclusive += 1
+            status, steps = Status.HALTED, steps + 1
+
+        except InputRequired:
+            status = Status.NEEDS_INPUT
+
+        computer.retired += steps
+        return status, steps
+
+    def routines(self):
+        """
+        Calls, inclusive and exclusive instructions by routine entry. A
+        recursive routine's inclusive count only includes its outermost
+        calls.
+        """
+        totals = {}
+
+        def visit(routine, active):
+            calls, inclusive, exclusive = totals.get(routine.entry, (0, 0, 0))
+            if routine.entry not in active:
+                inclusive += routine.inclusive
+            totals[routine.entry] = [
+                calls + routine.calls,
+                inclusive,
+                exclusive + routine.exclusive,
+            ]
+            for child in routine.children.values():
+                visit(child, active | {routine.entry})
+
+        visit(self.root, frozenset())
+        return totals
+
+    def table(self, limit=10):
+        retired = self.root.inclusive or 1
+        lines = [
+            f"{'routine':<24}{'calls':>10}{'inclusive':>14}{'exclusive':>14}"
+            f"{'share':>8}"
+        ]
+        ranked = sorted(self.routines().items(), key=lambda r: -r[1][1])
+        for entry, (calls, inclusive, exclusive) in ranked[:limit]:
+            name = Routine(entry).name
+            lines.append(
+                f"{name:<24}{calls:>10}{inclusive:>14}{exclusive:>14}"
+                f"{inclusive / retired:>8.1%}"
+            )
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("program", type=argparse.FileType())
+    parser.add_argument("--inputs", default="", help="comma-separated inputs")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument(
+        "--calls", action="store_true", help="report routines instead of addresses"
+    )
+    parser.add_argument(
+        "--collapsed", action="store_true", help="print folded call stacks"
+    )
+    parser.add_argument(
+        "--listing", action="store_true", help="print the program with its counts"
+    )
+    args = parser.parse_args()
+
+    program = IntcodeComputer.read_input(args.program.read())
+    inputs = IntcodeComputer.read_input(args.inputs) if args.inputs else []
+    computer = IntcodeComputer(program, Buffer(inputs), Buffer())
+
+    if args.calls or args.collapsed:
+        graph = CallGraph()
+        status, steps = graph.run(computer)
+        if args.collapsed:
+            print("\n".join(graph.root.collapsed()))
+        else:
+            print(f"{status.name} after {steps} instructions\n")
+            print(graph.table(args.limit))
+        sys.exit()
+
+    profile = Profile()
+    status, steps = profile.run(computer)
+    if args.json:
+        print(profile.json(args.limit))
+    elif args.listing:
+        print(ControlFlowGraph(program).listing(profile.addresses()))
+    else:
+        print(f"{status.name} after {steps} instructions\n")
+        print(profile.table(args.limit))
@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+"""
+A long-lived Intcode service on a local socket, and a client that drives the
+day 13, 15 and 19 workloads through it and reports their throughput:
+
+    python service.py serve --port 7019
+    python service.py bench --connect 127.0.0.1:7019
+    python service.py bench
+
+The protocol is line based. A connection sends one command at a time:
+
+    LOAD <program>          cache a comma-separated program, reply IMAGE <digest>
+    RUN <digest> [inputs]   run it on comma-separated inputs in the process pool
+    SESSION <digest>        run it interactively
+
+The outputs of a program come back one integer per line, followed by HALT
+once it has halted. In a session the server sends ? whenever the program
+needs input, and the client answers with one integer per line. Errors come
+back as ERROR <message>, after which the connection takes the next command.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import multiprocessing
+import time
+
+from intcode import Buffer, ComputerPool, IntcodeComputer, Status, load_image
+from workloads import Joystick, read_program
+
+# How many instructions a session runs before the other connections get a
+# turn.
+SLICE = 20000
+
+# The warm ComputerPools of a worker process, by image digest.
+POOLS = {}
+
+
+def run_job(digest, program, inputs):
+    """
+    Run `program` on `inputs` on a warm computer, and return its status and
+    outputs.
+    """
+    try:
+        pool = POOLS[digest]
+    except KeyError:
+        pool = POOLS[digest] = ComputerPool(load_image(program))
+
+    computer = pool.acquire()
+    computer.input_queue, computer.output_queue = Buffer(inputs), Buffer()
+    try:
+        status, _ = computer.run()
+        return status, computer.output_queue.drain()
+    finally:
+        pool.release(computer)
+
+
+class Service(object):
+    """
+    Serves any number of connections on one event loop. Programs are cached
+    as images by the hash of their source. RUN jobs go to a pool of
+    `processes` worker processes, or run in the server itself if that is 0.
+    Sessions run in the server, a slice of instructions at a time.
+
+    >>> async def demo():
+    ...     service = Service(processes=0)
+    ...     server = await service.start()
+    ...     client = await Client.connect(*server.sockets[0].getsockname()[:2])
+    ...     digest = await client.load([3,9,8,9,10,9,4,9,99,-1,8])
+    ...     ran = await client.run(digest, [8])
+    ...     await client.start(digest)
+    ...     waiting = await client.read()
+    ...     client.send(7)
+    ...     halted = await client.read()
+    ...     try:
+    ...         await client.run("00", [])
+    ...     except Exception as e:
+    ...         unknown = str(e)
+    ...     await client.close()
+    ...     server.close()
+    ...     await server.wait_closed()
+    ...     return ran, waiting, halted, unknown
+    >>> asyncio.run(demo())
+    ([1], ([], '?'), ([0], 'HALT'), 'Unknown image: 00')
+    """
+
+    def __init__(self, processes=None):
+        self.images = {}
+        self.executor = None
+        self.jobs = set()
+        if processes != 0:
+            # Forked workers would inherit the sockets of open connections
+            # and keep them from closing.
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                processes, multiprocessing.get_context("forkserver")
+            )
+
+    async def start(self, host="127.0.0.1", port=0):
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        if self.executor:
+            # shutdown(cancel_futures=True) needs Python 3.9.
+            for job in list(self.jobs):
+                job.cancel()
+            self.executor.shutdown()
+            self.executor = None
+
+    def image(self, digest):
+        try:
+            return self.images[digest]
+        except KeyError:
+            raise ValueError(f"Unknown image: {digest}")
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                command, _, argument = line.decode().strip().partition(" ")
+                try:
+                    if command == "LOAD":
+                        image = load_image(IntcodeComputer.read_input(argument))
+                        self.images[image.digest] = image
+                        writer.write(f"IMAGE {image.digest}\n".encode())
+                    elif command == "RUN":
+                        await self.run(argument, writer)
+                    elif command == "SESSION":
+                        await self.session(argument, reader, writer)
+                    else:
+                        raise ValueError(f"Unknown command: {command}")
+
+                except ConnectionError:
+                    raise
+                except Exception as e:
+                    writer.write(f"ERROR {e}\n".encode())
+
+                await writer.drain()
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
+
+    async def run(self, argument, writer):
+        digest, _, inputs = argument.partition(" ")
+        image = self.image(digest)
+        inputs = IntcodeComputer.read_input(inputs) if inputs else []
+
+        if self.executor:
+            job = self.executor.submit(run_job, digest, image.program, inputs)
+            self.jobs.add(job)
+            job.add_done_callback(self.jobs.discard)
+            status, outputs = await asyncio.wrap_future(job)
+        else:
+            status, outputs = run_job(digest, image.program, inputs)
+
+        writer.write("".join(f"{value}\n" for value in outputs).encode())
+        if status is not Status.HALTED:
+            raise ValueError("Program needs more input")
+        writer.write(b"HALT\n")
+
+    async def session(self, digest, reader, writer):
+        computer = IntcodeComputer(
+            self.image(digest), Buffer(), Buffer(), compiled=True
+        )
+        while True:
+            status, _ = computer.run(max_steps=SLICE)
+
+            outputs = computer.output_queue.drain()
+            writer.write("".join(f"{value}\n" for value in outputs).encode())
+
+            if status is Status.HALTED:
+                writer.write(b"HALT\n")
+                return
+
+            if status is Status.NEEDS_INPUT:
+                writer.write(b"?\n")
+                await writer.drain()
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("Session closed")
+                computer.input_queue.put(int(line))
+            else:
+                await writer.drain()
+                await asyncio.sleep(0)
+
+
+class Client(object):
+    """
+    One connection to the service. It counts the values it sends and
+    receives.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.sent = 0
+        self.received = 0
+
+    @classmethod
+    async def connect(cls, host, port):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+    async def line(self):
+        line = (await self.reader.readline()).decode().strip()
+        if not line:
+            raise ConnectionError("Service closed the connection")
+        return line
+
+    async def load(self, program):
+        self.writer.write(f"LOAD {','.join(map(str, program))}\n".encode())
+        reply, _, digest = (await self.line()).partition(" ")
+        if reply != "IMAGE":
+            raise Exception(digest)
+        return digest
+
+    async def run(self, digest, inputs):
+        """
+        Return the outputs of the program. Raises an exception with the
+        error message if the service couldn't run it.
+        """
+        self.writer.write(f"RUN {digest} {','.join(map(str, inputs))}\n".encode())
+        self.sent += len(inputs)
+        outputs, state = await self.read()
+        if state != "HALT":
+            raise Exception(state)
+        return outputs
+
+    async def start(self, digest):
+        self.writer.write(f"SESSION {digest}\n".encode())
+
+    def send(self, value):
+        self.writer.write(f"{value}\n".encode())
+        self.sent += 1
+
+    async def read(self):
+        """
+        Read outputs until the program needs input or has halted. Returns the
+        outputs and either ?, HALT or an error message.
+        """
+        outputs = []
+        while True:
+            line = await self.line()
+            if line in ("?", "HALT"):
+                self.received += len(outputs)
+                return outputs, line
+            if line.startswith("ERROR "):
+                return outputs, line[len("ERROR ") :]
+            outputs.append(int(line))
+
+
+async def arcade(host, port):
+    """
+    Play the day 13 game to the end and return the score.
+    """
+    program = read_program(13)
+    program[0] = 2
+    client = await Client.connect(host, port)
+    await client.start(await client.load(program))
+
+    joystick = Joystick()
+    while True:
+        outputs, state = await client.read()
+        for value in outputs:
+            joystick.put(value)
+        if state != "?":
+            break
+        client.send(joystick.get())
+
+    await client.close()
+    return joystick.score, [client]
+
+
+MOVES = {1: (0, -1), 2: (0, 1), 3: (-1, 0), 4: (1, 0)}
+BACK = {1: 2, 2: 1, 3: 4, 4: 3}
+
+
+async def droid(host, port):
+    """
+    Explore the day 15 area depth first in one session, stepping back after
+    every dead end, and return the position of the oxygen system.
+    """
+    client = await Client.connect(host, port)
+    await client.start(await client.load(read_program(15)))
+    await client.read()
+
+    async def step(move):
+        client.send(move)
+        outputs, _ = await client.read()
+        return outputs[0]
+
+    position, oxygen = (0, 0), None
+    seen = {position}
+    path = []
+    moves = [iter(MOVES)]
+    while moves:
+        move = next(moves[-1], None)
+        if move is None:
+            moves.pop()
+            if path:
+                back = path.pop()
+                await step(BACK[back])
+                position = (position[0] - MOVES[back][0], position[1] - MOVES[back][1])
+            continue
+
+        target = (position[0] + MOVES[move][0], position[1] + MOVES[move][1])
+        if target in seen:
+            continue
+        seen.add(target)
+
+        status = await step(move)
+        if status:
+            position = target
+            path.append(move)
+            moves.append(iter(MOVES))
+        if status == 2:
+            oxygen = target
+
+    await client.close()
+    return oxygen, [client]
+
+
+async def tractor_beam(host, port, connections=4):
+    """
+    Probe the 50x50 day 19 grid with one RUN per point, spread over a few
+    connections, and return the number of points in the beam.
+    """
+    clients = [await Client.connect(host, port) for _ in range(connections)]
+    digest = await clients[0].load(read_program(19))
+    points = [(x, y) for y in range(50) for x in range(50)]
+
+    async def probe(client, points):
+        return sum([(await client.run(digest, point))[0] for point in points])
+
+    counts = await asyncio.gather(
+        *(probe(client, points[i::connections]) for i, client in enumerate(clients))
+    )
+    for client in clients:
+        await client.close()
+    return sum(counts), clients
+
+
+WORKLOADS = {
+    "day 13 arcade": arcade,
+    "day 15 droid": droid,
+    "day 19 beam": tractor_beam,
+}
+
+
+async def bench(host, port, processes):
+    server = service = None
+    if host is None:
+        service = Service(processes)
+        server = await service.start()
+        host, port = server.sockets[0].getsockname()[:2]
+
+    print(
+        f"{'workload':<16}{'result':>12}{'values':>10}{'seconds':>10}{'values/s':>12}"
+    )
+    for label, workload in WORKLOADS.items():
+        start = time.perf_counter()
+        result, clients = await workload(host, port)
+        seconds = time.perf_counter() - start
+        values = sum(client.sent + client.received for client in clients)
+        print(
+            f"{label:<16}{str(result):>12}{values:>10}"
+            f"{seconds:>10.3f}{values / seconds:>12,.0f}"
+        )
+
+    if server:
+        server.close()
+        await server.wait_closed()
+        service.close()
+
+
+async def serve(host, port, processes):
+    service = Service(processes)
+    server = await service.start(host, port)
+    print("Serving on %s:%s" % server.sockets[0].getsockname()[:2])
+    try:
+        await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("mode", choices=["serve", "bench"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7019)
+    parser.add_argument("--connect", metavar="HOST:PORT")
+    parser.add_argument(
+        "--processes", type=int, help="worker processes for RUN jobs, 0 for none"
+    )
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        asyncio.run(serve(args.host, args.port, args.processes))
+    elif args.connect:
+        host, _, port = args.connect.rpartition(":")
+        asyncio.run(bench(host, int(port), args.processes))
+    else:
+        asyncio.run(bench(None, None, args.processes))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+import os
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class Joystick:
+    """
+    Stands in for both queues of the day 13 arcade and keeps the paddle
+    under the ball, so the game runs to the end without any threads.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.ball = 0
+        self.paddle = 0
+        self.score = 0
+
+    def put(self, val):
+        self.pending.append(val)
+        if len(self.pending) < 3:
+            return
+
+        x, y, tile = self.pending
+        self.pending = []
+        if (x, y) == (-1, 0):
+            self.score = tile
+        elif tile == 3:
+            self.paddle = x
+        elif tile == 4:
+            self.ball = x
+
+    def get(self):
+        return (self.ball > self.paddle) - (self.ball < self.paddle)
+
+
+def read_program(day):
+    with open(os.path.join(ROOT, str(day), "input")) as f:
+        return [int(i) for i in f.read().split(",")]